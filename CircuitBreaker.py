@@ -0,0 +1,105 @@
+""" Module to stop contacting unreachable UBNT devices for a while """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+import re
+import time
+import errno
+import fcntl
+from ResponseCache import makedirs_shared, open_shared
+
+
+class CircuitBreaker(object):
+    """
+    The consecutive failures to connect to a host (or get a response in
+    time), counted in a file under statedir, shared by processes.
+
+    Once there have been threshold failures, the circuit opens: check()
+    raises the last error right away, for cooldown seconds. After that,
+    a single process at a time is let through to probe the host; if it
+    fails again, the circuit stays open for another cooldown, otherwise
+    it closes. The caller reports the outcome of each attempt let
+    through with success() or failure().
+    """
+
+    def __init__(self, statedir, host, threshold, cooldown):
+        self.statedir = statedir
+        self.path = os.path.join(statedir, re.sub(r'[^\w.-]+', '_', host))
+        self.threshold = threshold
+        self.cooldown = cooldown
+        # Held while probing the host, in half-open state
+        self.probe = None
+
+    def _read(self, f):
+        """Return (failures, time opened, last error) from state file f."""
+        f.seek(0)
+        try:
+            (failures, opened, error) = f.read().split(" ", 2)
+            return (int(failures), float(opened), error)
+        except ValueError:
+            return (0, 0.0, "")
+
+    def check(self):
+        """Raise the last error if the circuit is open."""
+        try:
+            f = open(self.path, 'r')
+        except IOError:
+            # No failures
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            (failures, opened, error) = self._read(f)
+        finally:
+            f.close()
+        if (failures < self.threshold):
+            return
+
+        wait = opened + self.cooldown - time.time()
+        if (wait > 0):
+            raise Exception("%s (%d failures, not retrying for %d seconds)" %
+                            (error, failures, wait + 1))
+        # Let a single process probe the host
+        probe = open_shared(self.path + ".probe", 'a')
+        try:
+            fcntl.flock(probe, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, e:
+            probe.close()
+            if (e.errno not in (errno.EAGAIN, errno.EACCES)):
+                raise
+            raise Exception("%s (%d failures, being retried)" %
+                            (error, failures))
+        self.probe = probe
+
+    def success(self):
+        """Close the circuit, after a successful attempt."""
+        try:
+            os.unlink(self.path)
+        except OSError, e:
+            if (e.errno != errno.ENOENT):
+                raise
+        self._release()
+
+    def failure(self, error):
+        """Count a failed attempt, opening the circuit at threshold."""
+        makedirs_shared(self.statedir)
+        f = open_shared(self.path, 'a+')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            (failures, opened, last_error) = self._read(f)
+            failures += 1
+            if (failures >= self.threshold):
+                # Open, or stay open for another cooldown after a probe
+                opened = time.time()
+            f.seek(0)
+            f.truncate()
+            f.write("%d %f %s" % (failures, opened,
+                                  " ".join(str(error).split())))
+        finally:
+            f.close()
+        self._release()
+
+    def _release(self):
+        if (self.probe is not None):
+            self.probe.close()
+            self.probe = None
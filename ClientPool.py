@@ -0,0 +1,89 @@
+""" Module to keep UBNTClients logged in and connected between uses """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import time
+import threading
+from contextlib import contextmanager
+
+
+class ClientPool(object):
+    """
+    UBNTClients by key (e.g. the device), kept logged in and connected
+    between uses, until they have not been used for idle seconds, by
+    resident processes serving many requests. With size, at most that
+    many clients are kept, the least recently used ones being removed
+    to make room for new ones.
+    """
+
+    def __init__(self, idle, size=None):
+        self.idle = idle
+        self.size = size
+        self.lock = threading.Lock()
+        # key: [client, lock, time last used]
+        self.clients = {}
+
+    @contextmanager
+    def client(self, key, create, wait=True):
+        """
+        Use the client for key, created by create() if there is none, in
+        a with block, one block at a time per key; unless wait, a block
+        gets None instead of waiting while the client is in use. An
+        exception in the block drops the session and connection of the
+        client, so that the next use starts over.
+        """
+        evicted = []
+        with self.lock:
+            entry = self.clients.get(key)
+            if (entry is None):
+                if (self.size is not None):
+                    excess = len(self.clients) + 1 - self.size
+                    if (excess > 0):
+                        evicted = sorted(self.clients.items(),
+                                         key=lambda item: item[1][2])[:excess]
+                        for (evicted_key, evicted_entry) in evicted:
+                            del self.clients[evicted_key]
+                entry = self.clients[key] = [create(), threading.Lock(), 0]
+            entry[2] = time.time()
+        self._close(evicted)
+        if (not entry[1].acquire(wait)):
+            yield None
+            return
+        try:
+            yield entry[0]
+        except:
+            entry[0].logged_in = False
+            entry[0].close()
+            raise
+        finally:
+            entry[1].release()
+
+    def expire(self, idle=None):
+        """Logout and remove the clients not used for idle seconds."""
+        if (idle is None):
+            idle = self.idle
+        with self.lock:
+            expired = [(key, entry) for (key, entry) in self.clients.items()
+                       if time.time() - entry[2] >= idle]
+            for (key, entry) in expired:
+                del self.clients[key]
+        self._close(expired)
+
+    def _close(self, entries):
+        """Logout and close the clients of the (key, entry) pairs given."""
+        for (key, (client, lock, used)) in entries:
+            with lock:
+                # Avoid leaving open sessions
+                try:
+                    if (client.logged_in):
+                        client.reset_deadline()
+                        client.logout()
+                except Exception:
+                    pass
+                client.close()
+
+    def expire_forever(self):
+        """Expire idle clients every idle/2 seconds, e.g. in a thread."""
+        while True:
+            time.sleep(max(1, self.idle / 2))
+            self.expire()
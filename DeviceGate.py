@@ -0,0 +1,112 @@
+""" Module to limit and pace the requests to UBNT devices across processes """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+import re
+import time
+import fcntl
+from ResponseCache import try_flock, makedirs_shared, open_shared
+
+
+class DeviceGate(object):
+    """
+    The sessions and requests of all processes with a host, coordinated
+    through files under statedir.
+
+    try_acquire() takes one of slots session slots of the host, unless
+    all of them are held by other processes (or threads), until
+    release(). reserve() books the turn of a request, at least spacing
+    seconds after the last one booked, in the order processes ask.
+    Neither waits, so that event loops can wait for them with timers;
+    acquire() and pace() wait for them, and return the seconds waited,
+    the queueing delay.
+    """
+
+    def __init__(self, statedir, host, slots=0, spacing=0):
+        self.statedir = statedir
+        self.path = os.path.join(statedir, re.sub(r'[^\w.-]+', '_', host))
+        self.slots = slots
+        self.spacing = spacing
+        # The slot held, if any
+        self.slot = None
+
+    def try_acquire(self):
+        """Take a session slot if one is free; return whether taken."""
+        if (self.slots <= 0):
+            return True
+        makedirs_shared(self.statedir)
+        files = [open_shared("%s.slot%d" % (self.path, i), 'a')
+                 for i in range(self.slots)]
+        try:
+            for f in files:
+                if (try_flock(f)):
+                    files.remove(f)
+                    self.slot = f
+                    return True
+            return False
+        finally:
+            for f in files:
+                f.close()
+
+    def acquire(self, timeout=None):
+        """
+        Take a session slot, waiting for up to timeout seconds, if given;
+        return the seconds waited, or None if timed out.
+        """
+        start = time.time()
+        delay = 0.005
+        while (not self.try_acquire()):
+            if (timeout is not None and
+                    time.time() + delay > start + timeout):
+                return None
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        return time.time() - start
+
+    def release(self):
+        """Release the session slot taken by acquire()."""
+        if (self.slot is not None):
+            self.slot.close()
+            self.slot = None
+
+    def reserve(self, timeout=None):
+        """
+        Book the turn of a request, spacing seconds after the last one
+        booked by any process, and return the seconds until then; None,
+        booking nothing, if that is more than timeout seconds, if given.
+        """
+        if (self.spacing <= 0):
+            return 0.0
+        makedirs_shared(self.statedir)
+        f = open_shared(self.path + ".pace", 'a+')
+        try:
+            # Only held while booking
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                last = float(f.read() or 0)
+            except ValueError:
+                last = 0
+            now = time.time()
+            turn = max(now, last + self.spacing)
+            if (timeout is not None and turn - now > timeout):
+                return None
+            f.seek(0)
+            f.truncate()
+            f.write("%f" % turn)
+            f.flush()
+            return turn - now
+        finally:
+            f.close()
+
+    def pace(self, timeout=None):
+        """
+        Wait for the turn of a request (see reserve()); return the
+        seconds waited, or None if it would take more than timeout
+        seconds, if given.
+        """
+        wait = self.reserve(timeout)
+        if (wait):
+            time.sleep(wait)
+        return wait
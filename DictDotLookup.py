@@ -1,36 +1,73 @@
-__version__ = "1.0"
+__version__ = "2.0"
 __author__ = "David Moss"
 # zmousm: taken from here:
 # http://code.activestate.com/recipes/576586-dot-style-nested-lookups-over-dictionary-based-dat/
+# and rewritten as a lazy view, which does not copy the data
+
+
+def _wrap(value):
+    if isinstance(value, dict):
+        return DictDotLookup(value)
+    elif isinstance(value, (list, tuple)):
+        return DictDotList(value)
+    return value
 
-import pprint
 
 class DictDotLookup(object):
     """
     Creates objects that behave much like a dictionaries, but allow nested
     key access using object '.' (dot) lookups.
+
+    The dictionary is not copied; nested dictionaries and lists are only
+    wrapped (in the same way) when they are looked up.
     """
+    __slots__ = ('_d',)
+
     def __init__(self, d):
-        for k in d:
-            if isinstance(d[k], dict):
-                self.__dict__[k] = DictDotLookup(d[k])
-            elif isinstance(d[k], (list, tuple)):
-                l = []
-                for v in d[k]:
-                    if isinstance(v, dict):
-                        l.append(DictDotLookup(v))
-                    else:
-                        l.append(v)
-                self.__dict__[k] = l
-            else:
-                self.__dict__[k] = d[k]
+        self._d = d
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        try:
+            return _wrap(self._d[name])
+        except KeyError:
+            raise AttributeError(name)
 
     def __getitem__(self, name):
-        if name in self.__dict__:
-            return self.__dict__[name]
+        if name in self._d:
+            return _wrap(self._d[name])
+
+    def __iter__(self):
+        return iter(self._d.keys())
+
+    def __repr__(self):
+        import pprint
+        return pprint.pformat(self._d)
+
+
+class DictDotList(object):
+    """
+    A list (or tuple) whose items are wrapped like DictDotLookup values
+    when they are looked up.
+    """
+    __slots__ = ('_l',)
+
+    def __init__(self, l):
+        self._l = l
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return DictDotList(self._l[index])
+        return _wrap(self._l[index])
+
+    def __len__(self):
+        return len(self._l)
 
     def __iter__(self):
-        return iter(self.__dict__.keys())
+        for v in self._l:
+            yield _wrap(v)
 
     def __repr__(self):
-        return pprint.pformat(self.__dict__)
+        import pprint
+        return pprint.pformat(self._l)
@@ -0,0 +1,306 @@
+""" Module for restricted expressions used to modify probed values """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import ast
+import bisect
+import numbers
+import operator
+
+# The largest integer (in bits) a power may produce
+MAX_BITS = 4096
+
+
+def _numbers(name, *args):
+    # Repeating a string or a list (e.g. "x"*10**9) could exhaust memory
+    for arg in args:
+        if (not isinstance(arg, numbers.Number)):
+            raise TypeError("%s is only available for numbers" % name)
+
+
+def _mul(x, y):
+    _numbers('*', x, y)
+    return operator.mul(x, y)
+
+
+def _pow(x, y):
+    _numbers('**', x, y)
+    # Keep exponents sane, 9**9**9 would take forever
+    if (abs(y) > 100):
+        raise ValueError("exponent too large: %s" % y)
+    # ...and so would nested powers, e.g. ((10**100)**100)**100
+    if (isinstance(x, (int, long)) and isinstance(y, (int, long)) and
+            y > 0 and abs(x) > 1 and (abs(x).bit_length() - 1) * y > MAX_BITS):
+        raise ValueError("result too large: %d-bit number to the power of %s" %
+                         (abs(x).bit_length(), y))
+    return operator.pow(x, y)
+
+
+def _compare(ops):
+    def compare(*values):
+        for i, op in enumerate(ops):
+            if (not op(values[i], values[i + 1])):
+                return False
+        return True
+    return compare
+
+
+def _step(table):
+    """
+    Return a function mapping x to the value in table (a dict) for the
+    largest key less than x, e.g. with {0: 'low', 10: 'high'}, 5 maps
+    to 'low' and 15 to 'high'.
+    """
+    if (not isinstance(table, dict) or not len(table)):
+        raise ValueError("step() expects a non-empty dict")
+    keys = sorted(table)
+    values = [table[k] for k in keys]
+
+    def step(x):
+        i = bisect.bisect_left(keys, x)
+        if (i == 0):
+            raise ValueError("%s is not greater than any key in %s" %
+                             (x, table))
+        return values[i - 1]
+    return step
+
+
+def _method(name):
+    def method(obj, *args):
+        if (not isinstance(obj, basestring)):
+            raise TypeError("%s() is only available for strings" % name)
+        return getattr(obj, name)(*args)
+    return method
+
+
+class Expression(object):
+    """
+    An expression of VAL (e.g. VAL*100), parsed once into a restricted
+    syntax tree and compiled into a callable, so that it can be applied
+    to any number of values without parsing or evaluating it again.
+
+    Only the following are allowed: numbers and strings, VAL, True,
+    False and None, arithmetic (* and ** only for numbers, and powers of
+    limited size) and comparison operators, and/or/not, conditionals
+    (x if c else y), dict, list and tuple literals and subscripts (for
+    lookup tables), calls to the functions in FUNCTIONS and to the
+    string methods in METHODS. Parts of the expression that
+    do not depend on VAL, such as lookup tables, are evaluated once, when
+    the expression is compiled.
+
+    Use Expression.compile() to get the (cached) Expression for a text.
+    """
+    __slots__ = ('text', 'function')
+
+    _cache = {}
+
+    BINARY_OPERATORS = {
+        ast.Add: operator.add, ast.Sub: operator.sub,
+        ast.Mult: _mul, ast.Div: operator.div,
+        ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+        ast.Pow: _pow,
+    }
+    UNARY_OPERATORS = {
+        ast.USub: operator.neg, ast.UAdd: operator.pos,
+        ast.Not: operator.not_,
+    }
+    COMPARE_OPERATORS = {
+        ast.Eq: operator.eq, ast.NotEq: operator.ne,
+        ast.Lt: operator.lt, ast.LtE: operator.le,
+        ast.Gt: operator.gt, ast.GtE: operator.ge,
+        ast.In: lambda a, b: a in b, ast.NotIn: lambda a, b: a not in b,
+    }
+    FUNCTIONS = {
+        'min': min, 'max': max, 'abs': abs, 'round': round,
+        'int': int, 'float': float, 'str': str, 'len': len,
+    }
+    METHODS = ('strip', 'lstrip', 'rstrip', 'lower', 'upper', 'replace',
+               'split', 'startswith', 'endswith')
+    CONSTANTS = {'True': True, 'False': False, 'None': None}
+
+    def __init__(self, text):
+        self.text = text
+        try:
+            tree = ast.parse(text.strip(), mode='eval')
+        except SyntaxError, e:
+            raise ValueError("invalid expression '%s': %s" % (text, e.msg))
+        try:
+            (constant, function) = self._compile(tree.body)
+        except ValueError, e:
+            raise ValueError("invalid expression '%s': %s" % (text, e))
+        if (constant):
+            self.function = lambda v, c=function: c
+        else:
+            self.function = function
+
+    @classmethod
+    def compile(cls, text):
+        """Return the Expression for text, parsing it only the first time."""
+        try:
+            return cls._cache[text]
+        except KeyError:
+            expression = cls._cache[text] = cls(text)
+            return expression
+
+    def __call__(self, value):
+        """Return the result of the expression for VAL=value."""
+        return self.function(value)
+
+    def map(self, values):
+        """Return the results of the expression for each of values."""
+        function = self.function
+        return [function(v) for v in values]
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return "Expression(%r)" % self.text
+
+    def _apply(self, function, nodes):
+        """
+        Compile function applied to the given nodes; if they are all
+        constant, the result is computed now.
+        """
+        compiled = [self._compile(node) for node in nodes]
+        if (all(constant for (constant, f) in compiled)):
+            try:
+                return (True, function(*[c for (constant, c) in compiled]))
+            except (ArithmeticError, LookupError, TypeError, ValueError), e:
+                raise ValueError(str(e))
+
+        args = [f if not constant else (lambda v, c=f: c)
+                for (constant, f) in compiled]
+        if (len(args) == 1):
+            a = args[0]
+            return (False, lambda v: function(a(v)))
+        elif (len(args) == 2):
+            (a, b) = args
+            return (False, lambda v: function(a(v), b(v)))
+        return (False, lambda v: function(*[a(v) for a in args]))
+
+    def _compile(self, node):
+        """
+        Compile node; returns (True, value) if it is constant, otherwise
+        (False, function of VAL).
+        """
+        if (isinstance(node, ast.Num)):
+            return (True, node.n)
+        elif (isinstance(node, ast.Str)):
+            return (True, node.s)
+        elif (isinstance(node, ast.Name)):
+            if (node.id == 'VAL'):
+                return (False, lambda v: v)
+            elif (node.id in self.CONSTANTS):
+                return (True, self.CONSTANTS[node.id])
+            raise ValueError("unknown name: %s" % node.id)
+        elif (isinstance(node, ast.BinOp)):
+            return self._apply(self._operator(self.BINARY_OPERATORS, node.op),
+                               [node.left, node.right])
+        elif (isinstance(node, ast.UnaryOp)):
+            return self._apply(self._operator(self.UNARY_OPERATORS, node.op),
+                               [node.operand])
+        elif (isinstance(node, ast.Compare)):
+            ops = [self._operator(self.COMPARE_OPERATORS, op)
+                   for op in node.ops]
+            return self._apply(_compare(ops),
+                               [node.left] + node.comparators)
+        elif (isinstance(node, ast.BoolOp)):
+            return self._boolop(node)
+        elif (isinstance(node, ast.IfExp)):
+            return self._ifexp(node)
+        elif (isinstance(node, ast.Dict)):
+            n = len(node.keys)
+            return self._apply(lambda *kv: dict(zip(kv[:n], kv[n:])),
+                               node.keys + node.values)
+        elif (isinstance(node, ast.List)):
+            return self._apply(lambda *items: list(items), node.elts)
+        elif (isinstance(node, ast.Tuple)):
+            return self._apply(lambda *items: items, node.elts)
+        elif (isinstance(node, ast.Subscript)):
+            return self._subscript(node)
+        elif (isinstance(node, ast.Call)):
+            return self._call(node)
+        raise ValueError("%s not allowed" % node.__class__.__name__)
+
+    def _operator(self, operators, op):
+        try:
+            return operators[op.__class__]
+        except KeyError:
+            raise ValueError("operator %s not allowed" % op.__class__.__name__)
+
+    def _boolop(self, node):
+        compiled = [self._compile(value) for value in node.values]
+        if (all(constant for (constant, f) in compiled)):
+            values = [c for (constant, c) in compiled]
+            if (isinstance(node.op, ast.And)):
+                return (True, reduce(lambda a, b: a and b, values))
+            return (True, reduce(lambda a, b: a or b, values))
+
+        functions = [f if not constant else (lambda v, c=f: c)
+                     for (constant, f) in compiled]
+        if (isinstance(node.op, ast.And)):
+            def boolop(v):
+                for f in functions:
+                    result = f(v)
+                    if (not result):
+                        return result
+                return result
+        else:
+            def boolop(v):
+                for f in functions:
+                    result = f(v)
+                    if (result):
+                        return result
+                return result
+        return (False, boolop)
+
+    def _ifexp(self, node):
+        (test_constant, test) = self._compile(node.test)
+        if (test_constant):
+            return self._compile(node.body if test else node.orelse)
+
+        functions = [f if not constant else (lambda v, c=f: c)
+                     for (constant, f) in
+                     (self._compile(node.body), self._compile(node.orelse))]
+        (body, orelse) = functions
+        return (False, lambda v: body(v) if test(v) else orelse(v))
+
+    def _subscript(self, node):
+        if (isinstance(node.slice, ast.Index)):
+            return self._apply(operator.getitem,
+                               [node.value, node.slice.value])
+        elif (isinstance(node.slice, ast.Slice)):
+            none = ast.Name(id='None', ctx=ast.Load())
+            return self._apply(lambda obj, lower, upper, step:
+                               obj[lower:upper:step],
+                               [node.value, node.slice.lower or none,
+                                node.slice.upper or none,
+                                node.slice.step or none])
+        raise ValueError("%s not allowed" % node.slice.__class__.__name__)
+
+    def _call(self, node):
+        if (node.keywords or node.starargs or node.kwargs):
+            raise ValueError("only positional arguments are allowed")
+
+        if (isinstance(node.func, ast.Name)):
+            if (node.func.id == 'step'):
+                # Sort the (typically constant) table only once
+                if (len(node.args) != 2):
+                    raise ValueError("step() takes exactly 2 arguments")
+                (constant, table) = self._compile(node.args[1])
+                if (constant):
+                    return self._apply(_step(table), [node.args[0]])
+                return self._apply(lambda x, table: _step(table)(x),
+                                   node.args)
+            if (node.func.id in self.FUNCTIONS):
+                return self._apply(self.FUNCTIONS[node.func.id], node.args)
+            raise ValueError("unknown function: %s" % node.func.id)
+
+        elif (isinstance(node.func, ast.Attribute)):
+            if (node.func.attr in self.METHODS):
+                return self._apply(_method(node.func.attr),
+                                   [node.func.value] + node.args)
+            raise ValueError("unknown method: %s" % node.func.attr)
+
+        raise ValueError("%s not allowed" % node.func.__class__.__name__)
@@ -0,0 +1,223 @@
+""" Module to extract selected values from JSON data while reading it """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import re
+import sys
+if sys.version_info < (2, 6):
+    import simplejson as json
+else:
+    import json
+from KeyPath import KeyPath
+
+CHUNK_SIZE = 8192
+
+
+class _Done(Exception):
+    pass
+
+
+class _Node(object):
+    """A node in the trie of key paths to extract."""
+    __slots__ = ('children', 'target', 'total')
+
+    def __init__(self):
+        self.children = {}
+        self.target = False
+        self.total = 0
+
+
+class JSONStream(object):
+    """
+    Extract the values at the given key paths (see KeyPath) from a JSON
+    document, reading it incrementally from a file-like object.
+
+    extract() returns a sparse copy of the document, holding only the
+    branches leading to the requested values, so that looking these up
+    works as in the whole document. Other values are skipped without
+    being parsed, and reading stops as soon as all requested values
+    have been found. Where a key path contains a slice or a negative
+    index, the whole list is extracted.
+    """
+
+    _whitespace_re = re.compile(r'[ \t\n\r]*')
+    _string_re = re.compile(r'"(?:[^"\\]|\\.)*"')
+    _structure_re = re.compile(r'["\[\]{}]')
+    _scalar_re = re.compile(r'[^,:\[\]{}" \t\n\r]+')
+
+    def __init__(self, paths):
+        self.root = _Node()
+        self.total = 0
+        for path in set(paths):
+            if (not isinstance(path, KeyPath)):
+                path = KeyPath.compile(path)
+            nodes = [self.root]
+            for key in path.keys:
+                if (isinstance(key, slice) or
+                        (isinstance(key, int) and key < 0)):
+                    break
+                nodes.append(nodes[-1].children.setdefault(key, _Node()))
+            if (not nodes[-1].target):
+                nodes[-1].target = True
+                self.total += 1
+                for node in nodes:
+                    node.total += 1
+
+    def extract(self, fp):
+        """Read the JSON document from fp and return the sparse copy."""
+        self.fp = fp
+        self.buf = ''
+        self.pos = 0
+        self.mark = None
+        self.eof = False
+        self.found = 0
+
+        document = [None]
+        if (self.total):
+            try:
+                self._value(self.root, document, 0)
+            except _Done:
+                pass
+        return document[0]
+
+    def _more(self):
+        """Read more data, keeping what has not been consumed yet."""
+        if (self.eof):
+            return False
+        data = self.fp.read(CHUNK_SIZE)
+        if (not data):
+            self.eof = True
+            return False
+        keep = self.pos if (self.mark is None) else self.mark
+        self.buf = self.buf[keep:] + data
+        self.pos -= keep
+        if (self.mark is not None):
+            self.mark = 0
+        return True
+
+    def _peek(self):
+        """Skip whitespace and return the next character."""
+        while True:
+            self.pos = self._whitespace_re.match(self.buf, self.pos).end()
+            if (self.pos < len(self.buf)):
+                return self.buf[self.pos]
+            if (not self._more()):
+                raise ValueError("unexpected end of JSON data")
+
+    def _expect(self, char):
+        if (self._peek() != char):
+            raise ValueError("expected '%s' at JSON data offset %d" %
+                             (char, self.pos))
+        self.pos += 1
+
+    def _string(self):
+        """Consume a string and return it (JSON encoded)."""
+        while True:
+            m = self._string_re.match(self.buf, self.pos)
+            if (m is not None):
+                self.pos = m.end()
+                return m.group()
+            if (not self._more()):
+                raise ValueError("unterminated string in JSON data")
+
+    def _skip(self):
+        """Consume a value without parsing it."""
+        c = self._peek()
+        if (c == '"'):
+            self._string()
+        elif (c in '[{'):
+            depth = 0
+            while True:
+                m = self._structure_re.search(self.buf, self.pos)
+                if (m is None):
+                    self.pos = len(self.buf)
+                    if (not self._more()):
+                        raise ValueError("unexpected end of JSON data")
+                    continue
+                self.pos = m.start()
+                if (m.group() == '"'):
+                    self._string()
+                    continue
+                self.pos += 1
+                if (m.group() in '[{'):
+                    depth += 1
+                else:
+                    depth -= 1
+                    if (not depth):
+                        return
+        else:
+            while True:
+                m = self._scalar_re.match(self.buf, self.pos)
+                if (m is None):
+                    raise ValueError("invalid JSON data at offset %d" %
+                                     self.pos)
+                if (m.end() < len(self.buf) or not self._more()):
+                    self.pos = m.end()
+                    return
+
+    def _set(self, parent, key, value):
+        if (isinstance(parent, list) and key >= len(parent)):
+            parent.extend([None] * (key + 1 - len(parent)))
+        parent[key] = value
+
+    def _value(self, node, parent, key):
+        """Consume a value, extracting what node asks for into parent[key]"""
+        c = self._peek()
+        if (node.target):
+            self.mark = self.pos
+            try:
+                self._skip()
+                value = json.loads(self.buf[self.mark:self.pos])
+            finally:
+                self.mark = None
+            self._set(parent, key, value)
+            self.found += node.total
+            if (self.found == self.total):
+                raise _Done()
+        elif (c == '{'):
+            self.pos += 1
+            obj = {}
+            self._set(parent, key, obj)
+            if (self._peek() == '}'):
+                self.pos += 1
+                return
+            while True:
+                if (self._peek() != '"'):
+                    raise ValueError("expected a key at JSON data offset %d" %
+                                     self.pos)
+                name = json.loads(self._string())
+                self._expect(':')
+                child = node.children.get(name)
+                if (child is not None):
+                    self._value(child, obj, name)
+                else:
+                    self._skip()
+                c = self._peek()
+                self.pos += 1
+                if (c == '}'):
+                    return
+                elif (c != ','):
+                    raise ValueError("expected ',' or '}' at JSON data offset %d" % (self.pos - 1))
+        elif (c == '['):
+            self.pos += 1
+            lst = []
+            self._set(parent, key, lst)
+            if (self._peek() == ']'):
+                self.pos += 1
+                return
+            index = 0
+            while True:
+                child = node.children.get(index)
+                if (child is not None):
+                    self._value(child, lst, index)
+                else:
+                    self._skip()
+                index += 1
+                c = self._peek()
+                self.pos += 1
+                if (c == ']'):
+                    return
+                elif (c != ','):
+                    raise ValueError("expected ',' or ']' at JSON data offset %d" % (self.pos - 1))
+        else:
+            self._skip()
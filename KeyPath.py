@@ -0,0 +1,67 @@
+""" Module for nested lookups in JSON data using dotted notation """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import re
+
+
+class KeyPath(object):
+    """
+    A key in dotted notation (e.g. interfaces[2].status.speed), parsed
+    once into the sequence of dict keys and list indices (or slices)
+    that lead to the value in objects returned by json.loads().
+
+    Use KeyPath.compile() to get the (cached) KeyPath for a key.
+    """
+    __slots__ = ('path', 'keys')
+
+    _cache = {}
+    # ONLY match key[int_index_or_slice]... or [int_index_or_slice]...
+    _part_re = re.compile(r'^([^\[\]]+)?((?:\[(?:-?\d+|-?\d*(?::-?\d*){1,2})\])+)$')
+    _index_re = re.compile(r'\[([^\[\]]*)\]')
+
+    def __init__(self, path):
+        if (not len(path)):
+            raise ValueError("invalid key (empty string)")
+        self.path = path
+
+        keys = []
+        # split at '.' boundaries
+        for part in path.split('.'):
+            part_match = self._part_re.match(part)
+            if (part_match is None):
+                keys.append(part)
+                continue
+            if (part_match.group(1) is not None):
+                keys.append(part_match.group(1))
+            for index in self._index_re.findall(part_match.group(2)):
+                if (index.find(':') == -1):
+                    keys.append(int(index))
+                else:
+                    keys.append(slice(*[int(i) if len(i) else None
+                                        for i in index.split(':')]))
+        self.keys = tuple(keys)
+
+    @classmethod
+    def compile(cls, path):
+        """Return the KeyPath for path, parsing it only the first time."""
+        try:
+            return cls._cache[path]
+        except KeyError:
+            keypath = cls._cache[path] = cls(path)
+            return keypath
+
+    def get(self, data):
+        """
+        Return the value at this path in data; raises KeyError,
+        IndexError or TypeError if it is not there.
+        """
+        for key in self.keys:
+            data = data[key]
+        return data
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return "KeyPath(%r)" % self.path
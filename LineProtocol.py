@@ -0,0 +1,135 @@
+""" Module to format values as Graphite or InfluxDB lines and send them """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+import re
+import sys
+import time
+
+# Largest UDP datagram sent, split at line boundaries
+UDP_MAX = 8192
+
+
+def graphite_name(source, key):
+    """
+    Return the Graphite metric path for a key in dotted notation, with
+    indexes as path components, e.g. chainrssi.0 for chainrssi[0], after
+    the source for keys starting with an index (e.g. sta.0.signal)
+    """
+    if (key.startswith('[')):
+        key = source + key
+    path = re.sub(r'\[(-?\d+)\]', r'.\1', key).strip('.')
+    return re.sub(r'[^\w.-]+', '_', path)
+
+
+def graphite_tag(value):
+    return re.sub(r'[;=~!^\s]+', '_', value)
+
+
+def graphite_lines(prefix, host, items, timestamp=None):
+    """
+    Return lines in Graphite plaintext protocol, with tags, for items
+    [(source, key, value)], e.g. for (status, wireless.signal, -62):
+    <prefix>.wireless.signal;host=<host>;source=status -62 <timestamp>
+    """
+    if (timestamp is None):
+        timestamp = int(time.time())
+    lines = []
+    for (source, key, value) in items:
+        if (isinstance(value, (bool, int, long))):
+            value = str(int(value))
+        else:
+            try:
+                value = repr(float(value))
+            except (TypeError, ValueError):
+                raise Exception("%s: not a number: %r" % (key, value))
+        lines.append("%s.%s;host=%s;source=%s %s %d\n" % (
+            prefix, graphite_name(source, key), graphite_tag(host),
+            graphite_tag(source), value, timestamp))
+    return lines
+
+
+def influx_escape(s, chars=', ='):
+    return re.sub('([%s\\\\])' % chars, r'\\\1', s)
+
+
+def influx_value(value):
+    if (isinstance(value, bool)):
+        return "true" if value else "false"
+    if (isinstance(value, (int, long))):
+        return "%di" % value
+    if (isinstance(value, float)):
+        return repr(value)
+    return '"%s"' % influx_escape(unicode(value).encode('utf-8'), '"')
+
+
+def influx_lines(measurement, host, items, timestamp=None):
+    """
+    Return lines in InfluxDB line protocol for items [(source, key,
+    value)], one per source, with the keys as fields, e.g.
+    <measurement>,host=<host>,source=status wireless.signal=-62i <ns>
+    """
+    if (timestamp is None):
+        timestamp = int(time.time())
+    fields = {}
+    sources = []
+    for (source, key, value) in items:
+        if (source not in fields):
+            fields[source] = []
+            sources.append(source)
+        fields[source].append("%s=%s" % (influx_escape(key),
+                                         influx_value(value)))
+    return ["%s,host=%s,source=%s %s %d\n" % (
+        influx_escape(measurement, ', '), influx_escape(host),
+        influx_escape(source), ",".join(fields[source]),
+        timestamp * 1000000000) for source in sources]
+
+
+def write(dest, data):
+    """
+    Send data at once to dest: - (standard output), tcp://host:port,
+    udp://host:port (in as few datagrams as possible), unix:path (a
+    stream socket) or a file (appended to)
+    """
+    if (dest == '-'):
+        sys.stdout.write(data)
+        sys.stdout.flush()
+        return
+    match = re.match(r'(tcp|udp)://\[?([^\]]*)\]?:(\d+)$', dest)
+    if (match is None and not dest.startswith('unix:')):
+        fd = os.open(dest, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        return
+
+    import socket
+    try:
+        if (match is None):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = dest[len('unix:'):]
+        else:
+            address = socket.getaddrinfo(
+                match.group(2), int(match.group(3)), 0,
+                socket.SOCK_STREAM if match.group(1) == 'tcp'
+                else socket.SOCK_DGRAM)[0]
+            sock = socket.socket(*address[:3])
+            address = address[4]
+        try:
+            if (sock.type == socket.SOCK_STREAM):
+                sock.connect(address)
+                sock.sendall(data)
+                return
+            start = 0
+            while (start < len(data)):
+                end = data.rfind("\n", start, start + UDP_MAX) + 1
+                if (end <= start):
+                    end = start + UDP_MAX
+                sock.sendto(data[start:end], address)
+                start = end
+        finally:
+            sock.close()
+    except socket.error, e:
+        raise Exception("cannot send to %s: %s" % (dest, e))
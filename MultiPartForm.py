@@ -7,15 +7,17 @@ __author__ = "unknown"
 # http://atlee.ca/software/poster/index.html
 # but this was the easiest solution at the time (2012-03-16)
 
+import os
+import binascii
 import itertools
-import mimetools
-import mimetypes
 
 class MultiPartForm(object):
 
     def __init__(self):
         self.form_fields = []
-        self.boundary = mimetools.choose_boundary()
+        # zmousm: mimetools.choose_boundary() resolves the local hostname
+        # (once per process); a random boundary is as good and cheaper
+        self.boundary = binascii.hexlify(os.urandom(16))
         return
     
     def get_content_type(self):
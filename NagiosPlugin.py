@@ -2,9 +2,9 @@
 __version__ = "1.0"
 __author__ = "Omni Flux"
 
-import os
 import sys
 from optparse import OptionParser, OptionValueError, OptionGroup
+from KeyPath import KeyPath
 
 class NagiosPlugin (object):
 	returnValues = { 'OK' : 0, 'WARNING' : 1, 'CRITICAL' : 2, 'UNKNOWN' : 3 }
@@ -22,6 +22,9 @@ class NagiosPlugin (object):
 			self.start = start
 			self.end = end
 			self.exclusive = exclusive
+			# Parse bounds once, not on every check
+			self.startValue = float (start) if (start is not None) else None
+			self.endValue = float (end) if (end is not None) else None
 
 		def __str__ (self):
 			start = str (self.start) if (self.start is not None) else "~"
@@ -30,12 +33,14 @@ class NagiosPlugin (object):
 			return exclusive + start + ":" + end
 
 		def checkValue (self, value):
-			if (not NagiosPlugin._isNumeric (value)):
+			try:
+				value = float (value)
+			except ValueError:
 				return None
 
-			if (self.start is not None and float (value) < float (self.start)):
+			if (self.startValue is not None and value < self.startValue):
 				return True if (self.exclusive) else False
-			elif (self.end is not None and float (value) > float (self.end)):
+			elif (self.endValue is not None and value > self.endValue):
 				return True if (self.exclusive) else False
 			return False if (self.exclusive) else True
 
@@ -87,7 +92,37 @@ class NagiosPlugin (object):
 
 			setattr (parser.values, option.dest, thresholds)
 
-	def __init__ (self, version, description, usage = None, timeout = 10, epilog = None, thresholdHandler = None, thresholdWarningDefault = [], thresholdCriticalDefault = []):
+	class Metric (object):
+		"""
+		Specification of a metric, for checkMetrics: the label of its
+		performance data, the key (path) of its value in the data (the label
+		by default), a transform applied to the value, its UOM, min and max,
+		the position of its thresholds (None if it has none), a predicate of
+		the data telling whether the metric is available, and the value the
+		metric is expected to have, if any (otherwise the result is CRITICAL).
+		"""
+		def __init__ (self, label, key = None, transform = None, thresholdPosition = None, UOM = None, min = None, max = None, available = None, expect = None):
+			self.label = label
+			self.key = key if (key is not None) else label
+			self.keyPath = KeyPath.compile (self.key)
+			self.transform = transform
+			self.thresholdPosition = thresholdPosition
+			self.UOM = UOM
+			self.min = min
+			self.max = max
+			self.available = available
+			self.expect = expect
+
+		def getValue (self, data):
+			try:
+				value = self.keyPath.get (data)
+			except (KeyError, IndexError, TypeError):
+				raise Exception (self.key)
+			if (self.transform is not None):
+				value = self.transform (value)
+			return value
+
+	def __init__ (self, version, description, usage = None, timeout = 10, epilog = None, thresholdHandler = None, thresholdWarningDefault = [], thresholdCriticalDefault = [], parserClass = OptionParser):
 		self.version = version
 		self.description = description
 		self.epilog = epilog
@@ -100,7 +135,7 @@ class NagiosPlugin (object):
 			thresholdHandler = self._DefaultThresholdHandler
 
 		# Setup argument handler
-		self.parser = OptionParser (usage=usage, description=description, epilog=epilog)
+		self.parser = parserClass (usage=usage, description=description, epilog=epilog)
 		self.parser.add_option ("-V", "--version", action="store_true", help="show the version and exit")
 		self.parser.add_option ("-v", "--verbose", action="count", help="show debugging information")
 	 	self.parser.add_option ("-t", "--timeout", type="int", default=timeout, help="seconds before plugin times out (default: " + str (timeout) + ")")
@@ -109,15 +144,15 @@ class NagiosPlugin (object):
 	 	thresholdGroup.add_option ("-c", "--critical", action="callback", type="string", help="critical threshold", callback=thresholdHandler.parseThreshold, default=thresholdCriticalDefault)
 		self.parser.add_option_group (thresholdGroup)
 
-	def begin (self):
-		# Process arguments
-		(self.options, args) = self.parser.parse_args()
+	def begin (self, args = None):
+		# Process arguments (from the command line, unless args are given)
+		(self.options, args) = self.parser.parse_args (args)
 
 		if (self.options.version):
-			print os.path.basename (sys.argv[0]) + " " + self.version
+			print self.parser.get_prog_name() + " " + self.version
 			sys.exit()
 
-	def finish (self):
+	def getOutput (self):
 		# Generate output string
 		for key in self.returnValues:
 			if (self.returnValues[key] == self.returnValue):
@@ -155,18 +190,54 @@ class NagiosPlugin (object):
 				if (item['max'] is not None):
 					output += item['max']
 
+		return ''.join (output)
+
+	def finish (self):
 		# Print output
-		print ''.join (output)
+		print self.getOutput()
 
 		# Exit with correct return value
 		sys.exit (self.returnValue)
 
+	def getThresholds (self, thresholdPosition):
+		# Get warning and critical threshold handlers (or None)
+		warn = crit = None
+		if (thresholdPosition is not None):
+			if (thresholdPosition < len (self.options.warning)):
+				warn = self.options.warning[thresholdPosition]
+			if (thresholdPosition < len (self.options.critical)):
+				crit = self.options.critical[thresholdPosition]
+		return (warn, crit)
+
+	def checkMetrics (self, metrics, data):
+		# Extract and transform the value of each metric once, then add its
+		# performance data and check it, all in a single pass
+		for metric in metrics:
+			if (metric.available is not None and not metric.available (data)):
+				continue
+			value = metric.getValue (data)
+			(warn, crit) = self.getThresholds (metric.thresholdPosition)
+			self.performanceData.append ({'label': metric.label, 'value': value, 'UOM': metric.UOM, 'warn': str (warn) if (warn is not None) else None, 'crit': str (crit) if (crit is not None) else None, 'min': metric.min, 'max': metric.max})
+
+			if (metric.expect is not None):
+				if (str (value) != metric.expect):
+					self.returnValue = self.returnValues['CRITICAL']
+					self.returnString += " %s" % metric.label
+			elif (crit is not None and crit.checkValue (value)):
+				self.returnValue = self.returnValues['CRITICAL']
+				self.returnString += " %s" % metric.label
+			elif (warn is not None and warn.checkValue (value)):
+				if (self.returnValue != self.returnValues['CRITICAL']):
+					self.returnValue = self.returnValues['WARNING']
+				self.returnString += " %s" % metric.label
+
 	def addPerformanceData (self, label, value, thresholdPosition = 0, UOM = None, warn = None, crit = None, min = None, max = None):
-		# Get warning and critical ranges
-		if (thresholdPosition < len (self.options.critical) and self.options.critical[thresholdPosition] is not None):
-			crit = str (self.options.critical[thresholdPosition])
-		if (thresholdPosition < len (self.options.warning) and self.options.warning[thresholdPosition] is not None):
-			warn = str (self.options.warning[thresholdPosition])
+		# Get warning and critical ranges (none if thresholdPosition is None)
+		(warnThreshold, critThreshold) = self.getThresholds (thresholdPosition)
+		if (critThreshold is not None):
+			crit = str (critThreshold)
+		if (warnThreshold is not None):
+			warn = str (warnThreshold)
 
 		# Add performance data to stack
 		self.performanceData.append ({'label': label, 'value': value, 'UOM': UOM, 'warn': warn, 'crit': crit, 'min': min, 'max': max})
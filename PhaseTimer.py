@@ -0,0 +1,165 @@
+""" Module to time the phases of a run and count the bytes received """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import sys
+import time
+import threading
+
+
+def _monotonic_clock():
+    """
+    Return a function returning the time of a monotonic clock, in
+    seconds; time.time() if there is none available.
+    """
+    if (hasattr(time, 'monotonic')):
+        return time.monotonic
+    if (sys.platform.startswith('linux')):
+        clock_id = 1
+    elif (sys.platform == 'darwin'):
+        clock_id = 6
+    else:
+        return time.time
+    try:
+        import ctypes
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        try:
+            clock_gettime = ctypes.CDLL(None).clock_gettime
+        except AttributeError:
+            # glibc before 2.17
+            clock_gettime = ctypes.CDLL('librt.so.1').clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+        def monotonic():
+            ts = timespec()
+            if (clock_gettime(clock_id, ctypes.byref(ts)) != 0):
+                raise OSError("clock_gettime failed")
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+        monotonic()
+        return monotonic
+    except Exception:
+        return time.time
+
+
+class _Phase(object):
+    """Context manager for a phase, see PhaseTimer.phase()."""
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.inner = 0
+        self.timer._stack().append(self)
+        self.start = self.timer.clock()
+
+    def __exit__(self, *exc_info):
+        elapsed = self.timer.clock() - self.start
+        stack = self.timer._stack()
+        stack.pop()
+        # Time spent in a nested phase only counts for that one
+        if (len(stack)):
+            stack[-1].inner += elapsed
+        self.timer.add_time(self.name, elapsed - self.inner)
+
+
+class _TimedReader(object):
+    """File-like wrapper, timing reads as a phase and counting bytes."""
+
+    def __init__(self, fp, timer, phase, counter):
+        self.fp = fp
+        self.timer = timer
+        self.phase = phase
+        self.counter = counter
+
+    def read(self, *args):
+        with self.timer.phase(self.phase):
+            data = self.fp.read(*args)
+        self.timer.add_bytes(self.counter, len(data))
+        return data
+
+    def readline(self, *args):
+        with self.timer.phase(self.phase):
+            data = self.fp.readline(*args)
+        self.timer.add_bytes(self.counter, len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+
+class PhaseTimer(object):
+    """
+    Accumulate the time spent in named phases (e.g. connect, login,
+    fetch, parse, logout), measured with a monotonic clock, and the
+    bytes counted under other names (e.g. per data source).
+
+    Phases may be nested; the time spent in a nested phase is not
+    counted for the enclosing one. Phases of concurrent threads are
+    timed separately and added up.
+    """
+
+    clock = staticmethod(_monotonic_clock())
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.times = {}
+        self.bytes = {}
+        # Names in the order they were first recorded
+        self.time_names = []
+        self.byte_names = []
+
+    def reset(self):
+        """Start over, e.g. for another run of a resident process."""
+        with self._lock:
+            self.times = {}
+            self.bytes = {}
+            self.time_names = []
+            self.byte_names = []
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def phase(self, name):
+        """Return a context manager timing its block as phase name."""
+        return _Phase(self, name)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            if (name not in self.times):
+                self.times[name] = 0
+                self.time_names.append(name)
+            self.times[name] += seconds
+
+    def add_bytes(self, name, count):
+        with self._lock:
+            if (name not in self.bytes):
+                self.bytes[name] = 0
+                self.byte_names.append(name)
+            self.bytes[name] += count
+
+    def reader(self, fp, phase, counter):
+        """
+        Wrap the file-like fp, so that reading from it is timed as phase
+        and the bytes read are counted as counter.
+        """
+        return _TimedReader(fp, self, phase, counter)
+
+    def items(self):
+        """
+        Return [(label, value, UOM)], with the time of each phase as
+        time_<phase> (seconds) and the bytes as bytes_<name>.
+        """
+        with self._lock:
+            return ([("time_%s" % name, "%.6f" % self.times[name], "s")
+                     for name in self.time_names] +
+                    [("bytes_%s" % name, str(self.bytes[name]), "B")
+                     for name in self.byte_names])
@@ -0,0 +1,103 @@
+""" Module to plan the data sources to fetch for the keys of a run """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import itertools
+from KeyPath import KeyPath
+
+# The data sources of the devices of each platform (named as the models
+# of UBNTChecks.CHECKS): the approximate size of the response in bytes,
+# and the top-level keys of the data, or None for a list (e.g. of
+# stations). The same keys in different sources hold the same data.
+CATALOG = {
+    'AF24': {
+        'status': (3000, ('airfiber', 'genuine', 'gps', 'host', 'interfaces',
+                          'services', 'wireless')),
+        'iflist': (1100, ('interfaces',)),
+    },
+    'M': {
+        'status': (3800, ('firewall', 'genuine', 'host', 'interfaces', 'lan',
+                          'services', 'wan', 'wireless')),
+        'iflist': (2100, ('interfaces',)),
+        # About 2000 bytes per station
+        'sta': (20000, None),
+    },
+}
+
+# Each additional fetch also costs a request and a round trip, counted
+# as this many bytes
+REQUEST_COST = 2000
+
+
+def catalog(platform=None):
+    """
+    Return the catalog of the sources of platform, or of any platform
+    (the largest size and all keys of each source), if not given.
+    """
+    if (platform is not None):
+        return CATALOG[platform]
+    merged = {}
+    for sources in CATALOG.values():
+        for (source, (size, keys)) in sources.items():
+            if (source in merged and keys is not None):
+                keys = tuple(sorted(set(keys) | set(merged[source][1])))
+            merged[source] = (max(size, merged.get(source, (0,))[0]), keys)
+    return merged
+
+
+def providers(sources, source, key):
+    """
+    Return the sources providing key of source, that one first; only
+    that one if key is not a known top-level key of it (or is an index
+    in a list).
+    """
+    if (source not in sources or sources[source][1] is None):
+        return [source]
+    try:
+        top = KeyPath.compile(key).keys[0]
+    except ValueError:
+        return [source]
+    if (top not in sources[source][1]):
+        return [source]
+    return [source] + sorted(s for (s, (size, keys)) in sources.items()
+                             if s != source and keys is not None and
+                             top in keys)
+
+
+def plan(source_keys, platform=None):
+    """
+    Return the cheapest sources to fetch for the (source, key) pairs
+    given, in the order the pairs need them (so that the first one is
+    read from the response of the login), and the source to read each
+    pair from, in a dict by pair.
+
+    Sources not in the catalog are always fetched as given.
+    """
+    sources = catalog(platform)
+    choices = [providers(sources, source, key)
+               for (source, key) in source_keys]
+    required = set(c[0] for c in choices if len(c) == 1)
+    optional = sorted(set(s for c in choices for s in c) - required)
+
+    def cost(fetched):
+        return sum(sources.get(s, (0,))[0] + REQUEST_COST for s in fetched)
+
+    best = None
+    # A handful of sources per platform: try all combinations
+    for n in range(len(optional) + 1):
+        for extra in itertools.combinations(optional, n):
+            fetched = required | set(extra)
+            if (all(any(s in fetched for s in c) for c in choices) and
+                    (best is None or cost(fetched) < cost(best))):
+                best = fetched
+
+    # The source given if fetched, otherwise the smallest one fetched
+    reads = {}
+    order = []
+    for (pair, c) in zip(source_keys, choices):
+        source = min((s for s in c if s in best),
+                     key=lambda s: (s != pair[0], sources.get(s, (0,))[0]))
+        reads[pair] = source
+        if (source not in order):
+            order.append(source)
+    return (order, reads)
@@ -0,0 +1,135 @@
+""" Module to write values to round-robin databases (RRD files) """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+import re
+import time
+import subprocess
+
+# Averages and maxima for 2 days at the step (5 minutes by default), as
+# well as 12.5 days, 50 days and 2 years, like MRTG
+RRAS = ["RRA:%s:0.5:%d:800" % (cf, steps)
+        for cf in ("AVERAGE", "MAX") for steps in (1, 6, 24, 288)]
+
+
+def ds_names(source_keys):
+    """
+    Return names for data sources of the values at [(source, key)]: the
+    characters allowed in RRD data source names (at most 19) of the
+    end of each key, after the source for keys starting with an index
+    (e.g. sta_0_signal for sta/[0].signal), numbered from 2 onwards if
+    not unique.
+    """
+    names = []
+    for (source, key) in source_keys:
+        if (key.startswith('[')):
+            key = source + key
+        name = re.sub(r'\W+', '_', key).strip('_')[-19:] or "value"
+        i = 2
+        base = name
+        while (name in names):
+            suffix = str(i)
+            name = base[:19 - len(suffix)] + suffix
+            i += 1
+        names.append(name)
+    return names
+
+
+def rrd_value(value):
+    """Format value for an update: U if None, a number otherwise"""
+    if (value is None):
+        return "U"
+    if (isinstance(value, (bool, int, long))):
+        return str(int(value))
+    try:
+        return repr(float(value))
+    except (TypeError, ValueError):
+        raise Exception("not a number: %r" % (value,))
+
+
+class RRDWriter(object):
+    """
+    Creates and updates of RRD files, queued by update() and run all at
+    once by flush(): through the rrdtool Python binding, if installed,
+    or otherwise by a single rrdtool process reading them from its
+    standard input (rrdtool -), rather than one process per update.
+    """
+
+    def __init__(self, rrdtool="rrdtool"):
+        self.rrdtool = rrdtool
+        # [(filename, [command, args...])]
+        self.commands = []
+
+    def update(self, filename, ds, values, step=300, timestamp=None):
+        """
+        Queue an update of filename with values for the data sources
+        ds, [(name, type)], creating it with these if it does not exist.
+        """
+        update = [rrd_value(v) for v in values]
+        if (not os.path.exists(filename) and
+                filename not in [f for (f, c) in self.commands]):
+            self.commands.append((filename, [
+                "create", filename, "--step", str(step)] +
+                ["DS:%s:%s:%d:U:U" % (name, ds_type, step * 2)
+                 for (name, ds_type) in ds] + RRAS))
+        if (timestamp is None):
+            timestamp = int(time.time())
+        self.commands.append((filename, [
+            "update", filename, "--template",
+            ":".join(name for (name, ds_type) in ds),
+            ":".join([str(timestamp)] + update)]))
+
+    def flush(self):
+        """
+        Run the queued commands and return the errors, in a dict by
+        filename (the first error for each file).
+        """
+        commands = self.commands
+        self.commands = []
+        if (not commands):
+            return {}
+        try:
+            import rrdtool
+        except ImportError:
+            results = self._run_process(commands)
+        else:
+            results = []
+            for (filename, command) in commands:
+                try:
+                    getattr(rrdtool, command[0])(*command[1:])
+                    results.append(None)
+                except Exception, e:
+                    results.append(str(e))
+
+        errors = {}
+        for ((filename, command), error) in zip(commands, results):
+            if (error is not None and filename not in errors):
+                errors[filename] = error
+        return errors
+
+    def _run_process(self, commands):
+        """
+        Run commands in rrdtool -, returning the error (or None) of each
+        """
+        script = "".join(
+            " ".join('"%s"' % arg if re.search(r'\s', arg) else arg
+                     for arg in command) + "\n"
+            for (filename, command) in commands)
+        try:
+            p = subprocess.Popen([self.rrdtool, "-"], stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT)
+        except OSError, e:
+            raise Exception("cannot run %s: %s" % (self.rrdtool, e))
+        (out, err) = p.communicate(script)
+
+        # A line starting with OK or ERROR: for each command
+        results = []
+        for line in out.splitlines():
+            if (line.startswith("OK")):
+                results.append(None)
+            elif (line.startswith("ERROR:")):
+                results.append(line[len("ERROR:"):].strip())
+        missing = "%s exited with status %d" % (self.rrdtool, p.returncode)
+        return results + [missing] * (len(commands) - len(results))
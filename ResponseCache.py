@@ -0,0 +1,166 @@
+""" Module to cache the data of UBNT devices on disk, shared by processes """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+import re
+import errno
+import time
+import fcntl
+import marshal
+import tempfile
+
+# Modes of the directories and files of the state shared by the scripts:
+# the users running them (e.g. nagios and mrtg) share it through a
+# common group, inherited by new files from the (setgid) directories
+SHARED_DIR_MODE = 02770
+SHARED_FILE_MODE = 0660
+
+
+def makedirs_shared(path):
+    """Create directory path and any missing parents, shared by the group."""
+    if (os.path.isdir(path)):
+        return
+    parent = os.path.dirname(path)
+    if (parent and parent != path):
+        makedirs_shared(parent)
+    try:
+        os.mkdir(path)
+    except OSError:
+        # Created meanwhile by another process
+        if (not os.path.isdir(path)):
+            raise
+        return
+    # Not subject to the umask
+    os.chmod(path, SHARED_DIR_MODE)
+
+
+def open_shared(path, mode):
+    """Open file path, creating it writable by the group if missing."""
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL,
+                     SHARED_FILE_MODE)
+    except OSError, e:
+        if (e.errno != errno.EEXIST):
+            raise
+    else:
+        os.fchmod(fd, SHARED_FILE_MODE)
+        os.close(fd)
+    return open(path, mode)
+
+
+def try_flock(f):
+    """Lock f exclusively if not locked by another; return whether locked."""
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except IOError, e:
+        if (e.errno not in (errno.EAGAIN, errno.EACCES)):
+            raise
+        return False
+
+
+class _Locks(object):
+    """Exclusive locks held on cache entries, see ResponseCache.lock()."""
+
+    def __init__(self, files):
+        self.files = files
+
+    def release(self):
+        for f in reversed(self.files):
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+        self.files = []
+
+
+class ResponseCache(object):
+    """
+    The parsed data of each source of each host, kept in a file under
+    cachedir for ttl seconds.
+
+    Processes missing data call lock() (or try_lock() until it succeeds)
+    before fetching it and put(), so that concurrent processes wait for
+    a single fetch and then find fresh data in the cache, rather than
+    all of them requesting it from the device. Entries are written to a temporary file and renamed, so
+    get() never reads a partially written entry and takes no lock.
+    """
+
+    def __init__(self, cachedir, ttl):
+        self.cachedir = cachedir
+        self.ttl = ttl
+
+    def path(self, host, source):
+        return os.path.join(self.cachedir,
+                            re.sub(r'[^\w.-]+', '_', "%s_%s" % (host, source)))
+
+    def get(self, host, source):
+        """Return the data of source if cached and fresh, otherwise None."""
+        try:
+            f = open(self.path(host, source), 'rb')
+        except IOError:
+            return None
+        try:
+            if (time.time() - os.fstat(f.fileno()).st_mtime >= self.ttl):
+                return None
+            return marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            # Corrupt or written by another Python version
+            return None
+        finally:
+            f.close()
+
+    def put(self, host, source, data):
+        """Store the data of source."""
+        fd, tmpname = tempfile.mkstemp(dir=self.cachedir)
+        try:
+            os.fchmod(fd, SHARED_FILE_MODE)
+            f = os.fdopen(fd, 'wb')
+            try:
+                marshal.dump(data, f)
+            finally:
+                f.close()
+            os.rename(tmpname, self.path(host, source))
+        except:
+            os.unlink(tmpname)
+            raise
+
+    def try_lock(self, host, sources):
+        """
+        Lock the entries of sources, unless another process holds any of
+        them, and return the locks, or None; call release() on it after
+        put()ting the data.
+        """
+        makedirs_shared(self.cachedir)
+        locks = _Locks([])
+        try:
+            # Always in the same order, so that runs missing the same
+            # sources contend for the first one, rather than each
+            # holding some of them
+            for source in sorted(sources):
+                f = open_shared(self.path(host, source) + ".lock", 'a')
+                locks.files.append(f)
+                if (not try_flock(f)):
+                    locks.release()
+                    return None
+        except:
+            locks.release()
+            raise
+        return locks
+
+    def lock(self, host, sources, timeout=None):
+        """
+        Lock the entries of sources (see try_lock()), waiting for any
+        other process that holds them, for up to timeout seconds, if
+        given; return the locks, or None if timed out.
+        """
+        start = time.time()
+        delay = 0.005
+        while True:
+            locks = self.try_lock(host, sources)
+            if (locks is not None):
+                return locks
+            if (timeout is not None and
+                    time.time() + delay > start + timeout):
+                return None
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
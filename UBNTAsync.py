@@ -0,0 +1,1323 @@
+"""
+Module to poll many UBNT devices concurrently from a single thread
+
+AsyncUBNTClient is the client of the plugins and scripts, with every
+operation returning a future instead of blocking, so that any number of
+clients sharing a Loop run concurrently in a single thread (asyncore,
+with no thread per device). UBNTClient runs one on a loop of its own,
+blocking until each operation is done.
+"""
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+import re
+import sys
+import errno
+import fcntl
+import heapq
+import time
+import socket
+import httplib
+import asyncore
+import urlparse
+import threading
+import functools
+import collections
+from cStringIO import StringIO
+
+# Redirects followed for a request, as urllib2 does
+MAX_REDIRECTS = 10
+
+# Largest read from a connection at once
+READ_SIZE = 65536
+
+# Threads looking up host names for a loop, see Loop.resolve()
+RESOLVERS = 4
+
+
+def login_form(username, password, uri):
+    """Return the login form, redirecting to uri after login."""
+    from MultiPartForm import MultiPartForm
+    form = MultiPartForm()
+    form.add_field('username', username)
+    form.add_field('password', password)
+    form.add_field('Submit', 'Login')
+    form.add_field('uri', uri)
+    return form
+
+
+def check_content_type(resp, source):
+    """
+    Raise an exception unless resp, the response for /<source>.cgi, is
+    JSON data (as far as its content-type tells).
+    """
+    contype = resp.info()['Content-type']
+    if (contype != "application/json"):
+        # sta.cgi on AirOS returns text/html
+        if ((source == 'sta') and (contype == 'text/html')):
+            pass
+        else:
+            raise Exception("response has wrong content-type: " + contype)
+
+
+def json_parser(keys=None):
+    """
+    Return a function parsing the JSON data in a file-like object, only
+    the values at keys (in dotted notation), if given (see JSONStream).
+    """
+    if (keys is not None):
+        from JSONStream import JSONStream
+        return JSONStream(keys).extract
+    if sys.version_info < (2, 6):
+        import simplejson as json
+    else:
+        import json
+    return json.load
+
+
+class Return(Exception):
+    """Raised by a coroutine to return value (see Task)."""
+
+    def __init__(self, value=None):
+        Exception.__init__(self)
+        self.value = value
+
+
+class Future(object):
+    """The result of an operation, or the exception it raised, once done."""
+
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        """Return the result, or raise the exception, of the operation."""
+        if (not self._done):
+            raise Exception("the operation is still running")
+        if (self._exception is not None):
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        return self._exception
+
+    def add_done_callback(self, callback):
+        """Call callback(future) once done (right away if already done)."""
+        if (self._done):
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def set_result(self, result):
+        if (not self._done):
+            self._result = result
+            self._finish()
+
+    def set_exception(self, exception):
+        if (not self._done):
+            self._exception = exception
+            self._finish()
+
+    def _finish(self):
+        self._done = True
+        callbacks = self._callbacks
+        self._callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+
+class Task(Future):
+    """
+    Runs a coroutine, a generator yielding futures: each yield suspends
+    it until the future is done, then resumes it with the result of the
+    future (or raises its exception in the coroutine). The coroutine
+    returns a value, the result of the task, by raising Return(value).
+    """
+
+    def __init__(self, coroutine):
+        Future.__init__(self)
+        self.coroutine = coroutine
+        self._step(None, None)
+
+    def _step(self, value, exception):
+        # Iterate rather than recurse over futures already done
+        while True:
+            try:
+                if (exception is not None):
+                    future = self.coroutine.throw(exception)
+                else:
+                    future = self.coroutine.send(value)
+            except Return, r:
+                self.set_result(r.value)
+                return
+            except StopIteration:
+                self.set_result(None)
+                return
+            except Exception, e:
+                self.set_exception(e)
+                return
+            if (not future.done()):
+                future.add_done_callback(self._wakeup)
+                return
+            (value, exception) = (future._result, future._exception)
+
+    def _wakeup(self, future):
+        self._step(future._result, future._exception)
+
+
+def coroutine(func):
+    """Decorate a generator function to run it as a Task when called."""
+    def wrapper(*args, **kwargs):
+        return Task(func(*args, **kwargs))
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def gather(futures, return_exceptions=False):
+    """
+    Return a future of the results of futures, in a list, once all of
+    them are done: the exceptions raised are results too if
+    return_exceptions, otherwise the first one is raised.
+    """
+    futures = list(futures)
+    gathered = Future()
+    pending = [len(futures)]
+
+    def done(future):
+        pending[0] -= 1
+        if (pending[0] > 0 or gathered.done()):
+            return
+        results = []
+        for f in futures:
+            if (f.exception() is not None and not return_exceptions):
+                gathered.set_exception(f.exception())
+                return
+            results.append(f.exception() if f.exception() is not None
+                           else f._result)
+        gathered.set_result(results)
+
+    if (not futures):
+        gathered.set_result([])
+    for future in futures:
+        future.add_done_callback(done)
+    return gathered
+
+
+class _Waker(asyncore.file_dispatcher):
+    """
+    A pipe in the map of a loop, through which other threads have
+    callbacks run by the loop, see call().
+    """
+
+    def __init__(self, loop):
+        (self.rfd, self.wfd) = os.pipe()
+        asyncore.file_dispatcher.__init__(self, self.rfd, map=loop.map)
+        os.close(self.rfd)
+        fcntl.fcntl(self.wfd, fcntl.F_SETFL,
+                    fcntl.fcntl(self.wfd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.lock = threading.Lock()
+        self.callbacks = []
+
+    def call(self, callback):
+        """Have the loop call callback(), from any thread."""
+        with self.lock:
+            self.callbacks.append(callback)
+        try:
+            os.write(self.wfd, "x")
+        except OSError, e:
+            # Pipe full: the loop has been woken already
+            if (e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                raise
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(READ_SIZE)
+        with self.lock:
+            (callbacks, self.callbacks) = (self.callbacks, [])
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        asyncore.file_dispatcher.close(self)
+        os.close(self.wfd)
+
+
+class Loop(object):
+    """
+    The connections (in an asyncore socket map of their own) and timers
+    of any number of clients, served by run_until_complete() in the
+    calling thread.
+    """
+
+    def __init__(self):
+        self.map = {}
+        # Heap of [time, sequence, callback]
+        self.timers = []
+        self.sequence = 0
+        # Host names to look up, by up to RESOLVERS threads, which exit
+        # once there are none left
+        self.lock = threading.Lock()
+        self.lookups = collections.deque()
+        self.resolvers = 0
+        self.pending = 0
+        self.waker = None
+
+    def resolve(self, host, port):
+        """
+        Return a future of the address info (family, type, proto,
+        canonname, sockaddr) to connect to host: right away for an IP
+        address, otherwise looked up in a resolver thread, so that a
+        slow lookup does not hold up the other clients of the loop.
+        """
+        future = Future()
+        try:
+            future.set_result(socket.getaddrinfo(
+                host, port, 0, socket.SOCK_STREAM, 0,
+                socket.AI_NUMERICHOST)[0])
+            return future
+        except socket.gaierror:
+            pass
+        if (self.waker is None):
+            self.waker = _Waker(self)
+        self.pending += 1
+        with self.lock:
+            self.lookups.append((host, port, future))
+            if (self.resolvers < RESOLVERS):
+                self.resolvers += 1
+                resolver = threading.Thread(target=self._resolver)
+                resolver.daemon = True
+                resolver.start()
+        return future
+
+    def _resolver(self):
+        while True:
+            with self.lock:
+                if (not self.lookups):
+                    self.resolvers -= 1
+                    return
+                (host, port, future) = self.lookups.popleft()
+            try:
+                result = (socket.getaddrinfo(host, port, 0,
+                                             socket.SOCK_STREAM)[0], None)
+            except Exception, e:
+                result = (None, e)
+            waker = self.waker
+            if (waker is not None):
+                waker.call(functools.partial(self._resolved, future,
+                                             *result))
+
+    def _resolved(self, future, info, exception):
+        self.pending -= 1
+        if (exception is not None):
+            future.set_exception(exception)
+        else:
+            future.set_result(info)
+
+    def call_later(self, delay, callback):
+        """Call callback() in delay seconds; return a timer to cancel()."""
+        self.sequence += 1
+        timer = [time.time() + delay, self.sequence, callback]
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    @staticmethod
+    def cancel(timer):
+        timer[2] = None
+
+    def sleep(self, delay):
+        """Return a future done in delay seconds."""
+        future = Future()
+        self.call_later(delay, lambda: future.set_result(None))
+        return future
+
+    def _run_timers(self):
+        now = time.time()
+        while (self.timers and self.timers[0][0] <= now):
+            callback = heapq.heappop(self.timers)[2]
+            if (callback is not None):
+                callback()
+
+    def run_until_complete(self, future):
+        """Serve connections and timers until future is done; return its
+        result (or raise its exception)."""
+        while (not future.done()):
+            self._run_timers()
+            while (self.timers and self.timers[0][2] is None):
+                heapq.heappop(self.timers)
+            if (future.done()):
+                break
+            wait = 30.0
+            if (self.timers):
+                wait = max(0, min(wait, self.timers[0][0] - time.time()))
+            if (self.pending or len(self.map) > (self.waker is not None)):
+                # poll() rather than select(), for any number of sockets
+                asyncore.loop(wait, True, self.map, 1)
+            elif (self.timers):
+                time.sleep(wait)
+            else:
+                raise Exception("nothing to wait for")
+        return future.result()
+
+    def close(self):
+        """Close the pipe used by resolver threads, if any."""
+        if (self.waker is not None):
+            self.waker.close()
+            self.waker = None
+
+
+class _Response(object):
+    """
+    A response read whole, with the interface of urllib2 responses,
+    and the seconds taken until its headers were received (not counting
+    connecting) and then to read its body, if timed.
+    """
+
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.code = status
+        self.msg = reason
+        self.headers = httplib.HTTPMessage(StringIO(headers))
+        self.length = len(body)
+        self.fp = StringIO(body)
+        self.read = self.fp.read
+        self.readline = self.fp.readline
+        self.wait_time = 0
+        self.read_time = 0
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def close(self):
+        pass
+
+
+class _Connection(asyncore.dispatcher):
+    """
+    An HTTP/1.1 connection to a host, without blocking: each request()
+    sends a request and returns a future of the response, one request
+    at a time. Unless keepalive is False, the connection is kept open
+    for the next request, and opened again if the host has closed it
+    meanwhile.
+
+    If timer (a PhaseTimer) is given, connecting (including the TLS
+    handshake) is timed as the connect phase, and the responses are
+    timed too (see _Response).
+    """
+
+    def __init__(self, loop, host, port, context=None, keepalive=True,
+                 timer=None):
+        asyncore.dispatcher.__init__(self, map=loop.map)
+        self.loop = loop
+        self.address = (host, port)
+        self.context = context
+        self.keepalive = keepalive
+        self.timer = timer
+        self.connected = False
+        self.handshaking = False
+        self.future = None
+        # The lookup of the host, while connecting
+        self.resolving = None
+        # Whether the current request went over a connection used before
+        self.reused = False
+
+    def request(self, data, url):
+        if (self.future is not None):
+            raise Exception("a request is already in progress")
+        self.future = Future()
+        self.data = data
+        self.url = url
+        self.connect_time = 0
+        if (self.timer is not None):
+            self.sent_at = self.timer.clock()
+        self._reset()
+        if (self.socket is None and self.resolving is None):
+            try:
+                self._connect()
+            except:
+                self.future = None
+                raise
+        else:
+            self.reused = True
+        return self.future
+
+    def _reset(self):
+        self.outbuf = self.data
+        self.inbuf = ""
+        self.status = None
+        self.body = None
+        self.received = False
+
+    def _connect(self):
+        self.reused = False
+        self.connected = False
+        self.handshaking = False
+        if (self.timer is not None):
+            self.connecting_at = self.timer.clock()
+        self.resolving = self.loop.resolve(*self.address)
+        self.resolving.add_done_callback(self._resolved)
+
+    def _resolved(self, future):
+        if (future is not self.resolving):
+            # The request was aborted meanwhile, e.g. timed out
+            return
+        self.resolving = None
+        if (future.exception() is not None):
+            return self.abort(future.exception())
+        info = future.result()
+        try:
+            self.create_socket(info[0], info[1])
+            self.connect(info[4])
+        except Exception, e:
+            self.abort(e)
+
+    def _ready(self):
+        if (self.timer is not None):
+            elapsed = self.timer.clock() - self.connecting_at
+            self.connect_time += elapsed
+            self.timer.add_time('connect', elapsed)
+
+    def abort(self, exception):
+        """Fail the current request with exception, dropping the
+        connection."""
+        self.close()
+        if (self.future is not None):
+            (future, self.future) = (self.future, None)
+            future.set_exception(exception)
+
+    def close(self):
+        if (self.socket is not None):
+            asyncore.dispatcher.close(self)
+            self.socket = None
+        self.connected = False
+        self.resolving = None
+
+    def readable(self):
+        # Also while idle, to notice the device closing the connection
+        return True
+
+    def writable(self):
+        if (not self.connected):
+            return True
+        if (self.handshaking):
+            return self.want_write
+        return len(self.outbuf) > 0
+
+    def handle_connect(self):
+        if (self.context is None):
+            return self._ready()
+        sock = self.context.wrap_socket(
+            self.socket, do_handshake_on_connect=False,
+            server_hostname=self.address[0])
+        self.del_channel()
+        self.set_socket(sock)
+        self.handshaking = True
+        self.want_write = True
+
+    def handle_write(self):
+        if (self.handshaking):
+            return self._handshake()
+        try:
+            sent = self.socket.send(self.outbuf)
+        except socket.error, e:
+            if (e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                return
+            import ssl
+            if (isinstance(e, (ssl.SSLWantReadError,
+                               ssl.SSLWantWriteError))):
+                return
+            raise
+        self.outbuf = self.outbuf[sent:]
+
+    def _handshake(self):
+        import ssl
+        try:
+            self.socket.do_handshake()
+        except ssl.SSLWantReadError:
+            self.want_write = False
+            return
+        except ssl.SSLWantWriteError:
+            self.want_write = True
+            return
+        self.handshaking = False
+        self._ready()
+
+    def handle_read(self):
+        if (self.handshaking):
+            return self._handshake()
+        while True:
+            try:
+                data = self.socket.recv(READ_SIZE)
+            except socket.error, e:
+                if (e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK)):
+                    break
+                import ssl
+                if (isinstance(e, (ssl.SSLWantReadError,
+                                   ssl.SSLWantWriteError))):
+                    break
+                raise
+            if (not data):
+                return self._closed()
+            if (self.future is None):
+                # Nothing expected on an idle connection
+                self.close()
+                return
+            self.received = True
+            self.inbuf += data
+            self._parse()
+            # Read whatever TLS has decrypted already
+            if (self.socket is None or self.future is None or
+                    not getattr(self.socket, 'pending', lambda: 0)()):
+                break
+
+    def _closed(self):
+        self.close()
+        if (self.future is None):
+            return
+        if (self.status is not None and self.body is None):
+            # Response delimited by closing the connection
+            return self._done(self.inbuf)
+        if (self.reused and not self.received):
+            # Closed by the device while idle: try a new connection
+            self._reset()
+            self._connect()
+            return
+        self.abort(socket.error(errno.ECONNRESET,
+                                "connection closed by the device"))
+
+    def _parse(self):
+        if (self.status is None):
+            end = self.inbuf.find("\r\n\r\n")
+            if (end == -1):
+                return
+            if (self.timer is not None):
+                self.headers_at = self.timer.clock()
+            lines = self.inbuf[:end].split("\r\n")
+            self.inbuf = self.inbuf[end + 4:]
+            try:
+                (version, status, reason) = (lines[0].split(" ", 2) +
+                                             [""])[:3]
+                self.status = int(status)
+            except ValueError:
+                raise httplib.BadStatusLine(lines[0])
+            self.reason = reason
+            self.headers = "".join(line + "\r\n" for line in lines[1:])
+            header = dict((l.split(":", 1)[0].strip().lower(),
+                           l.split(":", 1)[1].strip())
+                          for l in lines[1:] if ":" in l)
+            self.keep = (self.keepalive and version == 'HTTP/1.1' and
+                         header.get('connection', '').lower() != 'close')
+            self.chunked = (header.get('transfer-encoding', '').lower() ==
+                            'chunked')
+            self.length = None
+            if ('content-length' in header and not self.chunked):
+                self.length = int(header['content-length'])
+            elif (not self.chunked):
+                # Until the device closes the connection
+                self.keep = False
+            self.chunks = []
+
+        if (self.chunked):
+            return self._parse_chunks()
+        if (self.length is not None and len(self.inbuf) >= self.length):
+            self._done(self.inbuf[:self.length])
+
+    def _parse_chunks(self):
+        while True:
+            end = self.inbuf.find("\r\n")
+            if (end == -1):
+                return
+            try:
+                size = int(self.inbuf[:end].split(";", 1)[0], 16)
+            except ValueError:
+                raise httplib.HTTPException("bad chunk size: %r" %
+                                            self.inbuf[:end])
+            if (size == 0):
+                # Skip any trailers
+                trailers = self.inbuf.find("\r\n\r\n", end)
+                if (trailers == -1 and self.inbuf[end:end + 4] != "\r\n\r\n"):
+                    return
+                return self._done("".join(self.chunks))
+            if (len(self.inbuf) < end + 2 + size + 2):
+                return
+            self.chunks.append(self.inbuf[end + 2:end + 2 + size])
+            self.inbuf = self.inbuf[end + 2 + size + 2:]
+
+    def _done(self, body):
+        self.body = body
+        if (not self.keep):
+            self.close()
+        resp = _Response(self.url, self.status, self.reason, self.headers,
+                         body)
+        if (self.timer is not None):
+            resp.wait_time = self.headers_at - self.sent_at - self.connect_time
+            resp.read_time = self.timer.clock() - self.headers_at
+        (future, self.future) = (self.future, None)
+        future.set_result(resp)
+
+    def handle_error(self):
+        exception = sys.exc_info()[1]
+        self.abort(exception)
+
+    def handle_close(self):
+        if (self.socket is not None and not self.connected):
+            err = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if (err != 0):
+                return self.abort(socket.error(err, os.strerror(err)))
+        self._closed()
+
+
+class AsyncUBNTClient(object):
+    """
+    A session with the web interface of a UBNT device, every operation
+    of which returns a future (a Task) instead of blocking, so that any
+    number of clients sharing loop run concurrently, e.g.:
+
+        loop = Loop()
+        clients = [AsyncUBNTClient(host, 'ubnt', password, loop, 10)
+                   for host in hosts]
+        results = loop.run_until_complete(gather(
+            [client.collect(['status']) for client in clients], True))
+
+    login() posts the login form; the result is the page the device
+    redirects to. fetch() requests /<source>.cgi; the result is the
+    parsed JSON data. logout() closes the session.
+
+    If sessiondir is given, the authenticated cookie jar is saved there
+    (one file per host and username) by logout() instead of logging out,
+    and it is reused by login() in later runs; the device is only logged
+    in again when the saved session has expired.
+
+    Unless keepalive is False, requests are sent over persistent
+    connections, so that a login, fetch and logout sequence normally
+    takes a single TCP connection (and TLS handshake); concurrent
+    requests, e.g. of fetch_all(), take a connection each.
+
+    collect() combines these, and takes the data from cache instead (see
+    ResponseCache), if given, as long as it is fresh. poll() fetches
+    data in a session kept open across calls instead, as does collect()
+    once keep_session is set (e.g. by a resident process).
+
+    If a timeout is given, it is the time budget (in seconds) for all the
+    requests to the device from the creation of the client (or the last
+    reset_deadline()) on; each request only gets the time left, and
+    running out of time raises an exception naming the stage reached.
+
+    If a breaker (see CircuitBreaker) is given, login() is not attempted
+    while its circuit is open; it counts failures to connect (or to get
+    a response in time) and other outcomes as successes.
+
+    If a gate (see DeviceGate) is given, the sessions of collect() and
+    poll() wait for a free session slot of the device, and every request
+    waits for its turn, as paced by the gate; the time waited counts
+    towards the timeout, and is reported as the queue phase (and with
+    verbose output).
+
+    The cache and the gate are shared with other processes through lock
+    files: these are only tried, never waited for, and tried again on
+    timers of the loop until taken, so that waiting for them does not
+    hold up the other clients of the loop.
+
+    If a timer (see PhaseTimer) is given, the time taken to connect,
+    login, fetch, parse and logout is recorded, along with the bytes of
+    each data source.
+    """
+
+    def __init__(self, httphost, username, password, loop, timeout=None,
+                 verbose=0, sessiondir=None, keepalive=True, timer=None,
+                 cache=None, breaker=None, gate=None):
+        import urllib2
+        import cookielib
+        self.httphost = httphost
+        self.username = username
+        self.password = password
+        self.loop = loop
+        self.verbose = verbose
+        self.sessiondir = sessiondir
+        self.keepalive = keepalive
+        self.timer = timer
+        self.cache = cache
+        # Whether poll() has logged in (see there)
+        self.logged_in = False
+        # Whether collect() keeps the session open, like poll()
+        self.keep_session = False
+        self.breaker = breaker
+        self.gate = gate
+        # Whether connecting or getting a response failed
+        self.connection_failed = False
+        self.timeout = timeout
+        self.deadline = None
+        self.reset_deadline()
+        # What the client is doing, for timeout errors
+        self.stage = "starting"
+
+        # We need session cookies
+        self.cookiejar = cookielib.LWPCookieJar()
+        if self.sessiondir is not None:
+            self.cookiejar.filename = os.path.join(
+                self.sessiondir,
+                re.sub(r'[^\w.-]+', '_', "%s_%s" % (httphost, username)))
+            try:
+                self.cookiejar.load(ignore_discard=True)
+            except (IOError, cookielib.LoadError):
+                # No saved session (yet)
+                pass
+
+        url = urlparse.urlparse(httphost)
+        if (url.scheme not in ('http', 'https') or not url.hostname):
+            # As urllib2 would report it
+            raise urllib2.URLError("unknown url type: %s" %
+                                   httphost.split(':', 1)[0])
+        self.context = None
+        if (url.scheme == 'https'):
+            # We typically can not verify peer certificates
+            # (self-signed, pre-installed on monitored devices)
+            import ssl
+            self.context = ssl.create_default_context()
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+        self.host = url.netloc
+        self.address = (url.hostname,
+                        url.port or (443 if self.context else 80))
+        self.connections = []
+
+    def reset_deadline(self, timeout=None):
+        """
+        Start the time budget over, e.g. for another poll(), with timeout
+        seconds, or else the timeout of the client.
+        """
+        if (timeout is None):
+            timeout = self.timeout
+        if (timeout is not None):
+            self.budget = timeout
+            self.deadline = time.time() + timeout
+
+    def time_left(self):
+        """Return the seconds left until the deadline, None if none."""
+        if (self.deadline is None):
+            return None
+        return self.deadline - time.time()
+
+    def can_logout(self):
+        """
+        Whether there is time left to logout, or no need for it, as the
+        session is saved instead.
+        """
+        return (self.sessiondir is not None or self.deadline is None or
+                self.time_left() > 0)
+
+    def timeout_error(self):
+        """
+        Return the error for running out of time at the current stage,
+        which counts as a connection failure.
+        """
+        self.connection_failed = True
+        return Exception("timed out after %g seconds while %s" %
+                         (self.budget, self.stage))
+
+    def _clock(self):
+        """Return the time of the timer, to pass to _timed(), if any."""
+        if (self.timer is None):
+            return None
+        return self.timer.clock()
+
+    def _timed(self, phase, start):
+        """Record the time since start (see _clock()) as phase."""
+        if (self.timer is not None):
+            self.timer.add_time(phase, self.timer.clock() - start)
+
+    def _discard(self, resp, phase):
+        """Count reading resp, which is not load()ed, as phase."""
+        if (self.timer is not None):
+            self.timer.add_time(phase, resp.read_time)
+
+    @coroutine
+    def _retry(self, attempt):
+        """
+        Call attempt() until it returns a true value, e.g. a lock taken
+        without waiting, backing off on timers of the loop in between,
+        until the deadline; the result is that value, or None if timed
+        out.
+        """
+        delay = 0.005
+        while True:
+            result = attempt()
+            if (result):
+                raise Return(result)
+            left = self.time_left()
+            if (left is not None and delay > left):
+                raise Return(None)
+            yield self.loop.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    @coroutine
+    def _acquire(self):
+        """
+        Take a session slot of the gate; the result is the seconds
+        waited, or None if none was free within the time left.
+        """
+        start = time.time()
+        acquired = yield self._retry(self.gate.try_acquire)
+        if (not acquired):
+            raise Return(None)
+        raise Return(time.time() - start)
+
+    @coroutine
+    def _pace(self):
+        """
+        Wait for the turn of a request, as paced by the gate; the result
+        is the seconds waited, or None if not within the time left.
+        """
+        wait = self.gate.reserve(self.time_left())
+        if (wait):
+            yield self.loop.sleep(wait)
+        raise Return(wait)
+
+    @coroutine
+    def queue(self, wait, what):
+        """
+        Wait for the gate with the coroutine wait(), e.g. _acquire, for
+        what, e.g. "for a session slot", within the time left.
+        """
+        stage = self.stage
+        self.stage = "waiting " + what
+        start = self._clock()
+        waited = yield wait()
+        self._timed('queue', start)
+        if (waited is None):
+            error = self.timeout_error()
+            # Not a failure of the device
+            self.connection_failed = False
+            raise error
+        if (self.verbose and waited >= 0.001):
+            print "Waited %.3f seconds %s" % (waited, what)
+        self.stage = stage
+
+    def _connection(self):
+        """Return an idle connection to the device, or a new one."""
+        for connection in self.connections:
+            if (connection.future is None):
+                return connection
+        connection = _Connection(self.loop, self.address[0],
+                                 self.address[1], self.context,
+                                 self.keepalive, self.timer)
+        self.connections.append(connection)
+        return connection
+
+    @coroutine
+    def _request(self, req, phase):
+        """
+        Send urllib2 Request req, at its turn with the gate, if any; the
+        result is the response, the time taken until its headers counting
+        as phase.
+        """
+        import urllib2
+        if (self.gate is not None):
+            yield self.queue(self._pace, "to pace requests")
+        if (self.deadline is not None and self.time_left() <= 0):
+            raise self.timeout_error()
+
+        data = req.get_data()
+        headers = ["%s %s HTTP/1.1" % (req.get_method(), req.get_selector()),
+                   "Host: %s" % self.host,
+                   "Accept-Encoding: identity",
+                   "User-Agent: Python-urllib/%s" % urllib2.__version__]
+        headers += ["%s: %s" % header for header in req.header_items()]
+        if (data is not None):
+            headers.append("Content-Length: %d" % len(data))
+        if (not self.keepalive):
+            headers.append("Connection: close")
+        request = "\r\n".join(headers) + "\r\n\r\n" + (data or "")
+
+        connection = self._connection()
+        future = connection.request(request, req.get_full_url())
+        expiry = None
+        if (self.deadline is not None):
+            expiry = self.loop.call_later(
+                self.time_left(),
+                lambda: connection.abort(self.timeout_error()))
+        try:
+            resp = yield future
+        except (socket.error, httplib.HTTPException), e:
+            self.connection_failed = True
+            # As urllib2 would report it
+            raise urllib2.URLError(e)
+        finally:
+            if (expiry is not None):
+                self.loop.cancel(expiry)
+        if (self.timer is not None):
+            self.timer.add_time(phase, resp.wait_time)
+        raise Return(resp)
+
+    @coroutine
+    def open(self, uri, data=None, content_type=None, phase='fetch'):
+        """
+        Request uri from the device, POSTing data if given, following
+        redirects, the time taken counting as phase (except reading the
+        last response, see load()); the result is the last response.
+        """
+        import urllib2
+        url = self.httphost + uri
+        for redirect in range(MAX_REDIRECTS + 1):
+            req = urllib2.Request(url, data)
+            if (data is not None):
+                req.add_header('Content-type', content_type)
+            self.cookiejar.add_cookie_header(req)
+            resp = yield self._request(req, phase)
+            self.cookiejar.extract_cookies(resp, req)
+            location = resp.info().getheader('Location')
+            if (resp.code in (301, 302, 303, 307) and location is not None):
+                self._discard(resp, phase)
+                # POSTs are redirected as GETs, as by urllib2
+                url = urlparse.urljoin(url, location)
+                if (not url.startswith(self.httphost)):
+                    raise Exception("redirected to another host: " + url)
+                data = None
+                continue
+            if (resp.code >= 400):
+                raise urllib2.HTTPError(url, resp.code, resp.msg,
+                                        resp.info(), resp.fp)
+            raise Return(resp)
+        raise Exception("too many redirects: " + url)
+
+    @coroutine
+    def login(self, uri='/index.cgi'):
+        """
+        Login; the result is the response for uri, where the device
+        redirects after login.
+        """
+        # Try the saved session, if any
+        if (self.sessiondir is not None and len(self.cookiejar)):
+            if (self.verbose >= 2):
+                print "Reusing saved session"
+            self.stage = "reusing the saved session"
+            resp = yield self.open(uri, phase='login')
+            if (resp.geturl() == self.httphost + uri):
+                raise Return(resp)
+            self._discard(resp, 'login')
+            if (self.verbose >= 2):
+                print "Saved session has expired"
+            self.cookiejar.clear()
+
+        # Must get a session cookie first
+        if (self.verbose >= 2):
+            print "Opening session"
+        self.stage = "opening a session"
+        resp = yield self.open('/login.cgi', phase='login')
+        self._discard(resp, 'login')
+
+        # Post the form to login
+        form = login_form(self.username, self.password, uri)
+        if (self.verbose >= 2):
+            print "Logging in"
+        self.stage = "logging in"
+        resp = yield self.open('/login.cgi', str(form),
+                               form.get_content_type(), 'login')
+
+        # Check we reached the right page after redirection post login
+        if (resp.geturl() != self.httphost + uri):
+            if (self.verbose >= 2):
+                print "Login may have failed"
+            raise Exception("reached a wrong page: " + resp.geturl())
+        raise Return(resp)
+
+    def load(self, resp, source, keys=None):
+        """
+        Parse the JSON data in resp, the response for /<source>.cgi
+
+        If keys (in dotted notation) are given, only the values at these
+        keys are parsed (see JSONStream).
+        """
+        # Check content-type (last resort) before passing to JSON parser
+        check_content_type(resp, source)
+        parse = json_parser(keys)
+        if (self.timer is None):
+            return parse(resp)
+
+        # Reading the response counts as fetching, the rest as parsing
+        self.timer.add_time('fetch', resp.read_time)
+        self.timer.add_bytes(source, resp.length)
+        start = self._clock()
+        try:
+            return parse(resp)
+        finally:
+            self._timed('parse', start)
+
+    @coroutine
+    def fetch(self, source, keys=None):
+        """
+        Request /<source>.cgi; the result is the parsed JSON data (only
+        the values at keys, if given).
+        """
+        uri = "/%s.cgi" % source
+        if (self.verbose >= 2):
+            print "Collecting data (%s)" % uri
+        self.stage = "fetching %s" % uri
+        resp = yield self.open(uri)
+
+        # Check we reached the right page (session may have expired)
+        if (resp.geturl() != self.httphost + uri):
+            raise Exception("reached a wrong page: " + resp.geturl())
+        raise Return(self.load(resp, source, keys))
+
+    @coroutine
+    def fetch_all(self, sources, keys=None):
+        """
+        Fetch each of the (distinct) sources, concurrently; the result is
+        the parsed JSON data in a dict by source. keys may map sources to
+        the keys to parse from each one.
+        """
+        sources = list(set(sources))
+        if (keys is None):
+            keys = {}
+        # All done before the first error (in the order of sources), if
+        # any, is raised
+        results = yield gather([self.fetch(source, keys.get(source))
+                                for source in sources])
+        raise Return(dict(zip(sources, results)))
+
+    @coroutine
+    def collect(self, sources, keys=None, uri=None):
+        """
+        Login, fetch each of the (distinct) sources and logout; the
+        result is the parsed JSON data in a dict by source (see
+        fetch_all()).
+
+        Login is to uri, or else to the first source, the data of which
+        is then read from the response of the login itself.
+
+        With a cache, the data of sources still fresh in it is taken from
+        there, so the device is only logged in if any are missing. These
+        are then fetched whole (ignoring keys), for any other run to use,
+        while holding their locks; concurrent runs missing them wait for
+        this fetch and use its data.
+        """
+        sources = [s for (i, s) in enumerate(sources)
+                   if s not in sources[:i]]
+        collect = self._poll if self.keep_session else self._collect
+        if (self.cache is None):
+            data = yield self.guarded(collect, sources, keys, uri)
+            raise Return(data)
+
+        data = {}
+        missing = []
+        for source in sources:
+            cached = self.cache.get(self.httphost, source)
+            if (cached is None):
+                missing.append(source)
+            else:
+                data[source] = cached
+        if (not missing):
+            if (self.verbose >= 2):
+                print "Using cached data"
+            raise Return(data)
+
+        self.stage = "waiting for another run fetching data"
+        locks = yield self._retry(
+            lambda: self.cache.try_lock(self.httphost, missing))
+        if (locks is None):
+            raise self.timeout_error()
+        try:
+            # Fetched meanwhile by a run holding the locks before us?
+            for source in list(missing):
+                cached = self.cache.get(self.httphost, source)
+                if (cached is not None):
+                    missing.remove(source)
+                    data[source] = cached
+            if (missing):
+                fetched = yield self.guarded(collect, missing, None, uri)
+                for (source, value) in fetched.items():
+                    self.cache.put(self.httphost, source, value)
+                data.update(fetched)
+        finally:
+            locks.release()
+        raise Return(data)
+
+    @coroutine
+    def guarded(self, func, *args):
+        """
+        Run the coroutine func(*args), unless the circuit of the breaker
+        (if any) is open, and report the outcome to it; with a gate,
+        while holding a session slot. The result is that of func.
+        """
+        if (self.gate is None):
+            result = yield self._guarded(func, *args)
+            raise Return(result)
+        # Before checking the circuit, which may have opened meanwhile
+        yield self.queue(self._acquire, "for a session slot")
+        try:
+            result = yield self._guarded(func, *args)
+        finally:
+            self.gate.release()
+        raise Return(result)
+
+    @coroutine
+    def _guarded(self, func, *args):
+        if (self.breaker is None):
+            result = yield func(*args)
+            raise Return(result)
+        self.breaker.check()
+        self.connection_failed = False
+        try:
+            result = yield func(*args)
+        except Exception, e:
+            if (self.connection_failed):
+                self.breaker.failure(e)
+            else:
+                self.breaker.success()
+            raise
+        self.breaker.success()
+        raise Return(result)
+
+    @coroutine
+    def _collect(self, sources, keys, uri):
+        if (keys is None):
+            keys = {}
+        if (uri is None and not sources):
+            raise Return({})
+        logged_in = False
+        try:
+            if (uri is None):
+                first = sources[0]
+                resp = yield self.login('/%s.cgi' % first)
+                logged_in = True
+                data = {first: self.load(resp, first, keys.get(first))}
+                fetched = yield self.fetch_all(sources[1:], keys)
+                data.update(fetched)
+            else:
+                yield self.login(uri)
+                logged_in = True
+                data = yield self.fetch_all(sources, keys)
+            if (self.can_logout()):
+                try:
+                    yield self.logout()
+                except Exception:
+                    # The data is there, even if logout ran out of time
+                    if (self.time_left() is None or self.time_left() > 0):
+                        raise
+                    if (self.verbose >= 2):
+                        print "Logout timed out"
+        except Exception:
+            # Saved, as yielding loses the exception being handled
+            error = sys.exc_info()
+            # Avoid leaving open sessions
+            if (logged_in and self.can_logout()):
+                try:
+                    yield self.logout()
+                except Exception:
+                    pass
+            raise error[0], error[1], error[2]
+        raise Return(data)
+
+    @coroutine
+    def poll(self, sources):
+        """
+        Fetch each of the (distinct) sources in a session kept open across
+        calls, e.g. by a resident exporter; the result is the parsed JSON
+        data in a dict by source. The device is only logged in at the
+        first call and whenever it has expired the session since; the
+        session is not logged out.
+        """
+        sources = [s for (i, s) in enumerate(sources)
+                   if s not in sources[:i]]
+        data = yield self.guarded(self._poll, sources)
+        raise Return(data)
+
+    @coroutine
+    def _poll(self, sources, keys=None, uri=None):
+        if (keys is None):
+            keys = {}
+        data = {}
+        if (self.logged_in):
+            for source in sources:
+                source_uri = "/%s.cgi" % source
+                self.stage = "fetching %s" % source_uri
+                resp = yield self.open(source_uri)
+                if (resp.geturl() != self.httphost + source_uri):
+                    if (self.verbose >= 2):
+                        print "Session has expired"
+                    self._discard(resp, 'fetch')
+                    break
+                data[source] = self.load(resp, source, keys.get(source))
+            else:
+                raise Return(data)
+
+        self.logged_in = False
+        missing = [s for s in sources if s not in data]
+        if (uri is not None):
+            yield self.login(uri)
+        elif (missing):
+            # The first source through the login itself
+            resp = yield self.login('/%s.cgi' % missing[0])
+            data[missing[0]] = self.load(resp, missing[0],
+                                         keys.get(missing[0]))
+        else:
+            raise Return(data)
+        self.logged_in = True
+        for source in missing:
+            if (source not in data):
+                data[source] = yield self.fetch(source, keys.get(source))
+        raise Return(data)
+
+    @coroutine
+    def logout(self):
+        """
+        Avoid leaving open sessions; if the session is to be reused,
+        save it instead.
+        """
+        start = self._clock()
+        if (self.sessiondir is not None):
+            if (self.verbose >= 2):
+                print "Saving session"
+            self.save_session()
+            self._timed('logout', start)
+            return
+
+        if (self.verbose >= 2):
+            print "Logging out"
+        self.logged_in = False
+        self.stage = "logging out"
+        resp = yield self.open('/logout.cgi', phase='logout')
+        self._discard(resp, 'logout')
+
+    def close(self):
+        """Close any connections kept open to the device."""
+        for connection in self.connections:
+            connection.close()
+
+    def save_session(self):
+        """Save the cookie jar, readable only by the current user."""
+        if (not os.path.isdir(self.sessiondir)):
+            from ResponseCache import makedirs_shared
+            makedirs_shared(os.path.dirname(self.sessiondir))
+            try:
+                os.mkdir(self.sessiondir, 0700)
+            except OSError:
+                # Created meanwhile by another process
+                if (not os.path.isdir(self.sessiondir)):
+                    raise
+        # Write a temporary file and rename it, so that concurrent runs
+        # never load a partially written jar
+        import tempfile
+        fd, tmpname = tempfile.mkstemp(dir=self.sessiondir)
+        os.close(fd)
+        try:
+            self.cookiejar.save(tmpname, ignore_discard=True)
+            os.rename(tmpname, self.cookiejar.filename)
+        except:
+            os.unlink(tmpname)
+            raise
@@ -0,0 +1,410 @@
+""" Module with the checks of the UBNT Nagios plugins """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import copy
+import heapq
+from optparse import OptionParser, OptionGroup
+from NagiosPlugin import NagiosPlugin
+from UBNTClient import UBNTClient
+from KeyPath import KeyPath
+
+Metric = NagiosPlugin.Metric
+
+USAGE = "Usage: %prog -H <hostname> [-U <username>] -P <password> [options]"
+
+def gps_dop_quality (dop):
+	"""Map GPS dilution of precision to a quality percentage"""
+	dop = float (dop)
+	if (dop > 20):
+		return 10
+	elif (dop > 15):
+		return 20
+	elif (dop > 10):
+		return 30
+	elif (dop > 7):
+		return 40
+	elif (dop > 5):
+		return 50
+	elif (dop > 3.5):
+		return 60
+	elif (dop > 2):
+		return 70
+	elif (dop > 1.5):
+		return 80
+	elif (dop > 1):
+		return 90
+	elif (dop > 0):
+		return 100
+	return 0
+
+def af24_temperature_available (data):
+	# dactemp0/dactemp1 not available beyond fwversion v1.x
+	return data['host']['fwversion'].find('v1.') == 0
+
+# Metrics from status.cgi, checked against the thresholds at their position
+AF24_METRICS = [
+	Metric ('airfiber.rxpower0', thresholdPosition=0, min='-100', max='0'),
+	Metric ('airfiber.rxpower1', thresholdPosition=1, min='-100', max='0'),
+	Metric ('airfiber.rxcapacity', thresholdPosition=2, min='0', max='750000000'),
+	Metric ('airfiber.txcapacity', thresholdPosition=3, min='0', max='750000000'),
+	Metric ('airfiber.txmodrate', transform=lambda v: str (v).rstrip('x'), thresholdPosition=4, min='0', max='6'),
+	Metric ('wireless.distance', thresholdPosition=5, min='100', max='15000'),
+	Metric ('airfiber.dactemp0', thresholdPosition=6, min='-50', max='65', available=af24_temperature_available),
+	Metric ('airfiber.dactemp1', thresholdPosition=7, min='-50', max='65', available=af24_temperature_available),
+	Metric ('gps.dop_quality', 'gps.dop', transform=gps_dop_quality, thresholdPosition=8, min='0', max='100', UOM='%'),
+	Metric ('gps.sats', thresholdPosition=9, min='0', max='10'),
+]
+
+# Keys used from status.cgi (besides those of boolean checks)
+AF24_KEYS = ['host.fwversion'] + [metric.key for metric in AF24_METRICS]
+
+def mismatch (a, b):
+	"""The difference of a and b, as a percentage of the largest"""
+	# Rates are strings in some firmware versions
+	(a, b) = (float (a), float (b))
+	if (max (a, b) <= 0):
+		return 0
+	return round (100 * abs (a - b) / max (a, b), 1)
+
+def af24_link_data (local, peer):
+	"""
+	Values of an AF24 link from the status of both ends: the difference
+	of the (strongest) receive power, and of the capacity, of the ends
+	"""
+	rxpower = lambda data: max (data['airfiber']['rxpower0'], data['airfiber']['rxpower1'])
+	return {
+		'rxpower_asymmetry': abs (rxpower (local) - rxpower (peer)),
+		'capacity_mismatch': mismatch (local['airfiber']['rxcapacity'], peer['airfiber']['rxcapacity']),
+	}
+
+# Metrics from af24_link_data, checked against the thresholds following
+# those of AF24_METRICS (at both ends)
+AF24_LINK_METRICS = [
+	Metric ('rxpower_asymmetry', thresholdPosition=len (AF24_METRICS), min='0'),
+	Metric ('capacity_mismatch', thresholdPosition=len (AF24_METRICS) + 1, UOM='%', min='0', max='100'),
+]
+
+M_METRICS = [
+	Metric ('signal', 'wireless.signal', thresholdPosition=0, min='-100', max='0'),
+	Metric ('signalchain0', 'wireless.chainrssi[0]', transform=lambda v: (96 - v) * -1, thresholdPosition=1, min='-100', max='0'),
+	Metric ('signalchain1', 'wireless.chainrssi[1]', transform=lambda v: (96 - v) * -1, thresholdPosition=2, min='-100', max='0'),
+	Metric ('noise', 'wireless.noisef', thresholdPosition=3, min='-100', max='0'),
+	Metric ('ccq', 'wireless.ccq', transform=lambda v: v / 10, thresholdPosition=4, UOM='%'),
+	Metric ('airmaxquality', 'wireless.polling.quality', thresholdPosition=5, UOM='%'),
+	Metric ('airmaxcapacity', 'wireless.polling.capacity', thresholdPosition=6, UOM='%'),
+	Metric ('txrate', 'wireless.txrate', thresholdPosition=7, min='0', max='270'),
+	Metric ('rxrate', 'wireless.rxrate', thresholdPosition=8, min='0', max='270'),
+]
+
+# Keys used from status.cgi
+M_KEYS = [metric.key for metric in M_METRICS]
+
+def m_link_data (local, peer):
+	"""
+	Values of an AirMAX (M) link from the status of both ends: the
+	difference of the signal, and of the receive rate, of the ends
+	"""
+	return {
+		'signal_asymmetry': abs (local['wireless']['signal'] - peer['wireless']['signal']),
+		'rxrate_mismatch': mismatch (local['wireless']['rxrate'], peer['wireless']['rxrate']),
+	}
+
+# Metrics from m_link_data, checked against the thresholds following
+# those of M_METRICS (at both ends)
+M_LINK_METRICS = [
+	Metric ('signal_asymmetry', thresholdPosition=len (M_METRICS), min='0'),
+	Metric ('rxrate_mismatch', thresholdPosition=len (M_METRICS) + 1, UOM='%', min='0', max='100'),
+]
+
+# Values of each station in sta.cgi, for multipoint checks: (label, key,
+# min, max, UOM); also the order of per-station thresholds
+STATION_FIELDS = [
+	('signal', 'signal', '-100', '0', None),
+	('ccq', 'ccq', '0', '100', '%'),
+	('txrate', 'tx', '0', '270', None),
+	('rxrate', 'rx', '0', '270', None),
+	('airmaxquality', 'airmax.quality', '0', '100', '%'),
+]
+STATION_PATHS = [KeyPath.compile (field[1]) for field in STATION_FIELDS]
+
+# Statistics of each value over all stations, as computed by
+# station_statistics
+STATISTICS = ['min', 'p10', 'p50', 'mean', 'max']
+
+def have_stations (data):
+	return data['stations'] > 0
+
+# Metrics from station_statistics, checked against the thresholds at
+# their position
+M_MULTIPOINT_METRICS = [Metric ('stations', thresholdPosition=0, min='0')] + [
+	Metric ('%s_%s' % (field[0], statistic), '%s.%s' % (field[0], statistic), thresholdPosition=1 + i * len (STATISTICS) + j, UOM=field[4], min=field[2], max=field[3], available=have_stations)
+	for i, field in enumerate (STATION_FIELDS)
+	for j, statistic in enumerate (STATISTICS)]
+
+def add_threshold_help (plugin, metrics, mode = None):
+	"""
+	Append the labels of the thresholds of metrics to the -w/-c help,
+	as those of another mode of the plugin, if given
+	"""
+	labels = ",".join (metric.label for metric in sorted (metrics, key=lambda m: m.thresholdPosition) if metric.thresholdPosition is not None)
+	for option in ("-w", "-c"):
+		option = plugin.parser.get_option (option)
+		if (mode is None):
+			option.help += "s (%s)" % labels
+		else:
+			option.help = option.help[:-1] + "; %s: %s)" % (mode, labels)
+
+def add_link_options (plugin, linkMetrics):
+	"""Add the options to check both ends of a link to plugin"""
+	add_threshold_help (plugin, linkMetrics, "with --peer, followed by")
+
+	linkGroup = OptionGroup (plugin.parser, "Link options")
+	linkGroup.add_option ("--peer", metavar="HTTPHOST", help="check both ends of a link, this device and its peer (as -H/--httphost), fetching data from both concurrently: the thresholds apply to each end, as well as to the differences of the ends (listed last), and the labels of the performance data start with local. or peer.")
+	linkGroup.add_option ("--peer-password", metavar="PASSWORD", help="password of the peer (default: -P/--password)")
+	plugin.parser.add_option_group (linkGroup)
+
+def af24_plugin (parserClass = OptionParser):
+	"""Setup the plugin for UBNT-AF24 radios, with all its options"""
+	plugin = NagiosPlugin (version="1.0", usage=USAGE, description="Nagios plugin for UBNT-AF24 radios (over HTTP)", parserClass=parserClass)
+	add_threshold_help (plugin, AF24_METRICS)
+
+	boolGroup = OptionGroup (plugin.parser, "Boolean check options")
+	boolGroup.add_option ("-b", "--boolean", help="Check that specific keys have particular values, otherwise the plugin returns CRITICAL (default: airfiber.rxpower0valid=1,airfiber.rxpower1valid=1,airfiber.rxoverload0=0,airfiber.rxoverload1=0,gps.status=1,gps.fix=1,airfiber.data_speed=1000Mbps-Full,airfiber.linkstate=operational)", default="airfiber.rxpower0valid=1,airfiber.rxpower1valid=1,airfiber.rxoverload0=0,airfiber.rxoverload1=0,gps.status=1,gps.fix=1,airfiber.data_speed=1000Mbps-Full,airfiber.linkstate=operational")
+	plugin.parser.add_option_group (boolGroup)
+	add_link_options (plugin, AF24_LINK_METRICS)
+
+	UBNTClient.add_options (plugin.parser)
+	return plugin
+
+def boolean_metrics (boolean):
+	"""Metrics for the boolean checks (key=value,...) of the -b option"""
+	metrics = []
+	for boolcheck in boolean.split(","):
+		boolcheckKeyVal = boolcheck.partition("=")
+		if (not len (boolcheckKeyVal[0]) or not len (boolcheckKeyVal[2])):
+			continue
+		metrics.append (Metric (boolcheckKeyVal[0], expect=boolcheckKeyVal[2]))
+	return metrics
+
+def check_af24 (plugin, client):
+	"""Collect data from an AF24 radio and check it"""
+	booleans = boolean_metrics (plugin.options.boolean)
+
+	if (plugin.options.verbose >= 2):
+		print "Logging in and collecting data"
+	keys = None
+	if (plugin.options.stream):
+		keys = {'status': AF24_KEYS + [metric.key for metric in booleans]}
+	if (plugin.options.peer is not None):
+		return check_link (plugin, client, keys, AF24_METRICS + booleans, AF24_LINK_METRICS, af24_link_data)
+	data = client.collect(['status'], keys)['status']
+
+	plugin.checkMetrics (AF24_METRICS + booleans, data)
+
+def m_plugin (parserClass = OptionParser):
+	"""Setup the plugin for UBNT-M radios, with all its options"""
+	plugin = NagiosPlugin (version="1.0", usage=USAGE, description="Nagios plugin for UBNT-M radios (over HTTP)", parserClass=parserClass)
+	add_threshold_help (plugin, M_METRICS)
+	add_threshold_help (plugin, M_MULTIPOINT_METRICS, "with --multipoint")
+
+	labels = ",".join (label for (label, key, min, max, UOM) in STATION_FIELDS)
+	parseThreshold = plugin.parser.get_option ("-w").callback
+	mpGroup = OptionGroup (plugin.parser, "Multipoint options")
+	mpGroup.add_option ("--multipoint", action="store_true", help="check all stations of an AP (from sta.cgi) instead of the link of a station: the number of stations, and the minimum, 10th percentile, median, mean and maximum of the signal, CCQ, rates and airMAX quality over all stations")
+	mpGroup.add_option ("--station-warning", action="callback", type="string", callback=parseThreshold, default=[], help="warning thresholds for each station (%s); the result is WARNING if any station is outside them" % labels)
+	mpGroup.add_option ("--station-critical", action="callback", type="string", callback=parseThreshold, default=[], help="critical thresholds for each station (%s); the result is CRITICAL if any station is outside them" % labels)
+	mpGroup.add_option ("--worst", type="int", default=3, metavar="N", help="list the N stations with the weakest signal, and up to N stations outside the thresholds (default: 3)")
+	plugin.parser.add_option_group (mpGroup)
+	add_link_options (plugin, M_LINK_METRICS)
+
+	UBNTClient.add_options (plugin.parser)
+	return plugin
+
+def station_name (station):
+	return station.get ('remote', {}).get ('hostname') or station.get ('name') or station.get ('mac', '?')
+
+def station_statistics (stations, warning = [], critical = []):
+	"""
+	Compute the statistics of the STATION_FIELDS of stations, and find
+	those outside the warning or critical thresholds (by field), in a
+	single pass over all stations. Return the statistics, as
+	{'stations': count, label: {statistic: value}}, and the stations
+	outside the thresholds, as [(state, name, label, value)].
+	"""
+	thresholds = []
+	for i in range (len (STATION_FIELDS)):
+		warn = warning[i] if (i < len (warning)) else None
+		crit = critical[i] if (i < len (critical)) else None
+		thresholds.append ((warn, crit))
+
+	values = [[] for field in STATION_FIELDS]
+	outliers = []
+	for station in stations:
+		for (i, path) in enumerate (STATION_PATHS):
+			try:
+				value = path.get (station)
+			except (KeyError, IndexError, TypeError):
+				continue
+			values[i].append (value)
+			(warn, crit) = thresholds[i]
+			if (crit is not None and crit.checkValue (value)):
+				outliers.append (('CRITICAL', station_name (station), STATION_FIELDS[i][0], value))
+			elif (warn is not None and warn.checkValue (value)):
+				outliers.append (('WARNING', station_name (station), STATION_FIELDS[i][0], value))
+
+	statistics = {'stations': len (stations)}
+	for (i, field) in enumerate (STATION_FIELDS):
+		fieldValues = sorted (values[i])
+		n = len (fieldValues)
+		if (not n):
+			continue
+		statistics[field[0]] = {
+			'min': fieldValues[0],
+			# Nearest rank percentiles
+			'p10': fieldValues[(n * 10 + 99) / 100 - 1],
+			'p50': fieldValues[(n * 50 + 99) / 100 - 1],
+			'mean': round (float (sum (fieldValues)) / n, 1),
+			'max': fieldValues[-1],
+		}
+	return (statistics, outliers)
+
+def check_m_multipoint (plugin, client):
+	"""Collect the stations of an AirMAX (M) AP and check them"""
+	if (plugin.options.verbose >= 2):
+		print "Logging in and collecting data"
+	stations = client.collect(['sta'])['sta']
+
+	(statistics, outliers) = station_statistics (stations, plugin.options.station_warning, plugin.options.station_critical)
+	plugin.checkMetrics (M_MULTIPOINT_METRICS, statistics)
+
+	states = [state for (state, name, label, value) in outliers]
+	for state in ('CRITICAL', 'WARNING'):
+		plugin.addPerformanceData ('stations_%s' % state.lower(), states.count (state), None, min='0')
+	if ('CRITICAL' in states):
+		plugin.returnValue = plugin.returnValues['CRITICAL']
+	elif ('WARNING' in states and plugin.returnValue != plugin.returnValues['CRITICAL']):
+		plugin.returnValue = plugin.returnValues['WARNING']
+
+	worst = plugin.options.worst
+	if (len (outliers) and worst > 0):
+		# Critical ones first
+		outliers.sort (key=lambda outlier: outlier[0] != 'CRITICAL')
+		plugin.returnString += " %d outside station thresholds: %s%s" % (len (set ((name for (state, name, label, value) in outliers))), ", ".join ("%s %s=%s" % (name, label, value) for (state, name, label, value) in outliers[:worst]), ", ..." if (len (outliers) > worst) else "")
+	signals = [(station['signal'], station_name (station)) for station in stations if 'signal' in station]
+	if (len (signals) and worst > 0):
+		plugin.returnString += " weakest: %s" % ", ".join ("%s %s" % (name, signal) for (signal, name) in heapq.nsmallest (worst, signals))
+
+def check_m (plugin, client):
+	"""Collect data from an AirMAX (M) radio and check it"""
+	if (plugin.options.multipoint):
+		return check_m_multipoint (plugin, client)
+
+	if (plugin.options.verbose >= 2):
+		print "Logging in and collecting data"
+	keys = None
+	if (plugin.options.stream):
+		keys = {'status': M_KEYS}
+	if (plugin.options.peer is not None):
+		return check_link (plugin, client, keys, M_METRICS, M_LINK_METRICS, m_link_data)
+	data = client.collect(['status'], keys)['status']
+
+	plugin.checkMetrics (M_METRICS, data)
+
+def end_metrics (metrics, end):
+	"""Copies of metrics labeled as those of an end of a link"""
+	endMetrics = []
+	for metric in metrics:
+		metric = copy.copy (metric)
+		metric.label = "%s.%s" % (end, metric.label)
+		endMetrics.append (metric)
+	return endMetrics
+
+def collect_ends (ends, keys):
+	"""
+	Collect status.cgi with each client of ends, [(end, client)],
+	concurrently on the loop of the clients (the same one), and return
+	the data of each end in a list
+	"""
+	from UBNTAsync import gather
+	loop = ends[0][1].loop
+	results = loop.run_until_complete (gather ([client.async_client.collect (['status'], keys) for (end, client) in ends], True))
+	for ((end, client), result) in zip (ends, results):
+		if (isinstance (result, Exception)):
+			raise Exception ("%s: %s" % (end, result))
+	return [result['status'] for result in results]
+
+def check_link (plugin, client, keys, metrics, linkMetrics, linkData):
+	"""
+	Collect data from both ends of a link concurrently, with client and
+	a client for --peer, and check metrics at each end and linkMetrics
+	of linkData (local, peer)
+	"""
+	options = copy.copy (plugin.options)
+	options.httphost = plugin.options.peer
+	if (plugin.options.peer_password is not None):
+		options.password = plugin.options.peer_password
+	peer = UBNTClient.from_options (options, loop=client.loop)
+	try:
+		if (plugin.options.verbose >= 2):
+			print "Logging in and collecting data from both ends"
+		(localData, peerData) = collect_ends ([('local', client), ('peer', peer)], keys)
+
+		plugin.checkMetrics (end_metrics (metrics, 'local'), localData)
+		plugin.checkMetrics (end_metrics (metrics, 'peer'), peerData)
+		plugin.checkMetrics (linkMetrics, linkData (localData, peerData))
+	finally:
+		peer.close()
+		if (peer.timer is not None):
+			for (label, value, UOM) in peer.timer.items():
+				plugin.addPerformanceData ("peer.%s" % label, value, None, UOM=UOM)
+
+# The checks by model: (function to setup the plugin, check function)
+CHECKS = {
+	'AF24': (af24_plugin, check_af24),
+	'M': (m_plugin, check_m),
+}
+
+def begin (plugin, args = None):
+	"""Process the arguments of a plugin setup by one of the functions above"""
+	plugin.begin (args)
+	UBNTClient.check_options (plugin.parser, plugin.options)
+	if (plugin.options.peer is not None and getattr (plugin.options, 'multipoint', False)):
+		plugin.parser.error ("--peer and --multipoint are mutually exclusive")
+
+def run (plugin, check, client = None):
+	"""
+	Run check with the options of plugin, leaving the result in plugin;
+	errors make the result UNKNOWN. A client given (e.g. kept in a
+	ClientPool) is used instead of a new one, and left open; it has to
+	be for the same device and options.
+	"""
+	own = client is None
+	try:
+		# All requests have to be done within -t/--timeout seconds
+		if (own):
+			client = UBNTClient.from_options (plugin.options)
+		else:
+			client.reset_deadline (plugin.options.timeout)
+			if (client.timer is not None):
+				client.timer.reset()
+		check (plugin, client)
+
+	except Exception, e:
+		if (plugin.options.verbose >= 2):
+			import traceback
+			traceback.print_exc(e)
+		plugin.returnValue = plugin.returnValues['UNKNOWN']
+		plugin.returnString = str(e)
+		if (not own):
+			# Start over with a new session (and connection) next time
+			client.logged_in = False
+			client.close()
+
+	finally:
+		if (client is not None):
+			if (own):
+				client.close()
+			if (client.timer is not None):
+				for (label, value, UOM) in client.timer.items():
+					plugin.addPerformanceData (label, value, None, UOM=UOM)
@@ -0,0 +1,178 @@
+""" Module to login to UBNT devices and fetch data over HTTP """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+from optparse import OptionGroup
+
+# The modules for HTTP, cookies, JSON etc. are imported where they are
+# first needed, so that a plugin only spends startup time on the ones
+# it actually uses (none for --help or --version)
+
+STATE_DIR = "/var/tmp/ubnt-nagios-plugins"
+
+
+def _delegated(name, doc):
+    """Property for attribute name of the AsyncUBNTClient of a UBNTClient."""
+    return property(lambda self: getattr(self.async_client, name),
+                    lambda self, value: setattr(self.async_client, name,
+                                                value),
+                    doc=doc)
+
+
+class UBNTClient(object):
+    """
+    A session with the web interface of a UBNT device, blocking: the
+    operations of an AsyncUBNTClient (see UBNTAsync for the arguments
+    and what each one does) are run on loop, or else a loop of its own,
+    until done, returning their result.
+
+    Clients sharing a loop can run operations of their AsyncUBNTClients
+    concurrently, e.g. with UBNTAsync.gather().
+    """
+
+    timer = _delegated('timer', "The PhaseTimer, if timed")
+    logged_in = _delegated('logged_in', "Whether poll() has logged in")
+    keep_session = _delegated('keep_session',
+                              "Whether collect() keeps the session open")
+
+    def __init__(self, httphost, username, password, verbose=0,
+                 sessiondir=None, keepalive=True, timer=None, cache=None,
+                 timeout=None, breaker=None, gate=None, loop=None):
+        from UBNTAsync import Loop, AsyncUBNTClient
+        # Closed along with the client, unless shared
+        self.own_loop = loop is None
+        if (loop is None):
+            loop = Loop()
+        self.loop = loop
+        self.async_client = AsyncUBNTClient(
+            httphost, username, password, loop, timeout=timeout,
+            verbose=verbose, sessiondir=sessiondir, keepalive=keepalive,
+            timer=timer, cache=cache, breaker=breaker, gate=gate)
+
+    @staticmethod
+    def add_options(parser):
+        """Add the connection and authentication options to parser."""
+        connGroup = OptionGroup(parser, "Connection options")
+        connGroup.add_option("-H", "--httphost", help="HTTP(S) protocol, hostname, port (optional), as URL, e.g: http://example.com:port, https://example.com etc.")
+        connGroup.add_option("--stream", action="store_true", help="parse only the values needed while reading responses, instead of whole documents")
+        connGroup.add_option("--no-keepalive", action="store_false", dest="keepalive", default=True, help="open a new connection for every request, instead of keeping one open for all requests to the device")
+        connGroup.add_option("--timing", action="store_true", help="report the time taken to connect, login, fetch and parse data and logout, and the bytes of data fetched")
+        parser.add_option_group(connGroup)
+
+        authGroup = OptionGroup(parser, "Authentication options")
+        authGroup.add_option("-U", "--username", default="ubnt", help="username (default: 'ubnt')")
+        authGroup.add_option("-P", "--password", help="password")
+        parser.add_option_group(authGroup)
+
+        stateGroup = OptionGroup(parser, "State options")
+        stateGroup.add_option("--state-dir", default=STATE_DIR, help="directory for state kept between runs (default: " + STATE_DIR + ")")
+        stateGroup.add_option("--session-cache", action="store_true", help="keep the login session in the state directory and reuse it in later runs, instead of logging in and out every time")
+        stateGroup.add_option("--circuit-failures", type="int", default=0, metavar="N", help="after N consecutive failures to connect to the device (or get a response in time) in any runs, fail right away, with the last error, for --circuit-cooldown seconds, before letting a single run try again (default: 0, always try)")
+        stateGroup.add_option("--circuit-cooldown", type="int", default=300, metavar="SECONDS", help="seconds to fail right away after --circuit-failures (default: 300)")
+        stateGroup.add_option("--max-sessions", type="int", default=0, metavar="N", help="wait while N runs (of any plugin or script) have a session with the device (default: 0, no limit)")
+        stateGroup.add_option("--request-spacing", type="float", default=0, metavar="SECONDS", help="send requests to the device at least this many seconds apart, across all runs (default: 0)")
+        stateGroup.add_option("--cache-ttl", type="int", default=0, metavar="SECONDS", help="keep the data fetched from the device in the state directory for this many seconds and use it in later runs (of any plugin or script) instead of fetching it again; concurrent runs wait for a single fetch (default: 0, no cache)")
+        parser.add_option_group(stateGroup)
+
+    @staticmethod
+    def check_options(parser, options):
+        """Validate the options added by add_options()."""
+        if (options.httphost is None):
+            parser.error("-H/--httphost is required")
+
+        if (options.password is None):
+            parser.error("-P/--password option is required")
+
+    @classmethod
+    def from_options(cls, options, loop=None):
+        """Create a client as specified by the options, on loop if given."""
+        sessiondir = None
+        if options.session_cache:
+            # Private to each user, in the state shared with the others
+            sessiondir = os.path.join(options.state_dir, "sessions",
+                                      str(os.getuid()))
+        timer = None
+        if options.timing:
+            from PhaseTimer import PhaseTimer
+            timer = PhaseTimer()
+        cache = None
+        if options.cache_ttl > 0:
+            from ResponseCache import ResponseCache
+            cache = ResponseCache(os.path.join(options.state_dir, "cache"),
+                                  options.cache_ttl)
+        breaker = None
+        if options.circuit_failures > 0:
+            from CircuitBreaker import CircuitBreaker
+            breaker = CircuitBreaker(
+                os.path.join(options.state_dir, "circuits"), options.httphost,
+                options.circuit_failures, options.circuit_cooldown)
+        gate = None
+        if options.max_sessions > 0 or options.request_spacing > 0:
+            from DeviceGate import DeviceGate
+            gate = DeviceGate(
+                os.path.join(options.state_dir, "gates"), options.httphost,
+                options.max_sessions, options.request_spacing)
+        return cls(options.httphost, options.username, options.password,
+                   verbose=options.verbose, sessiondir=sessiondir,
+                   keepalive=options.keepalive, timer=timer, cache=cache,
+                   timeout=getattr(options, 'timeout', None), breaker=breaker,
+                   gate=gate, loop=loop)
+
+    def reset_deadline(self, timeout=None):
+        """
+        Start the time budget over, e.g. for another poll(), with timeout
+        seconds, or else the timeout of the client.
+        """
+        self.async_client.reset_deadline(timeout)
+
+    def login(self, uri='/index.cgi'):
+        """
+        Login and return the response for uri, where the device
+        redirects after login.
+        """
+        return self.loop.run_until_complete(self.async_client.login(uri))
+
+    def fetch(self, source, keys=None):
+        """
+        Request /<source>.cgi and return the parsed JSON data (only the
+        values at keys, if given).
+        """
+        return self.loop.run_until_complete(
+            self.async_client.fetch(source, keys))
+
+    def fetch_all(self, sources, keys=None):
+        """
+        Fetch each of the (distinct) sources, concurrently, and return the
+        parsed JSON data in a dict by source.
+        """
+        return self.loop.run_until_complete(
+            self.async_client.fetch_all(sources, keys))
+
+    def collect(self, sources, keys=None, uri=None):
+        """
+        Login, fetch each of the (distinct) sources and logout, returning
+        the parsed JSON data in a dict by source, from the cache if any.
+        """
+        return self.loop.run_until_complete(
+            self.async_client.collect(sources, keys, uri))
+
+    def poll(self, sources):
+        """
+        Fetch each of the (distinct) sources in a session kept open across
+        calls, and return the parsed JSON data in a dict by source.
+        """
+        return self.loop.run_until_complete(self.async_client.poll(sources))
+
+    def logout(self):
+        """
+        Avoid leaving open sessions; if the session is to be reused,
+        save it instead.
+        """
+        return self.loop.run_until_complete(self.async_client.logout())
+
+    def close(self):
+        """Close any connections kept open to the device."""
+        self.async_client.close()
+        if (self.own_loop):
+            self.loop.close()
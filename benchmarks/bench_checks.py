@@ -0,0 +1,195 @@
+#!/usr/bin/python
+
+""" Benchmark the plugins and scripts against fake UBNT devices """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+import sys
+import time
+import shutil
+import urllib2
+import tempfile
+import subprocess
+from optparse import OptionParser
+if sys.version_info < (2, 6):
+    import simplejson as json
+else:
+    import json
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Scenarios: (name, model of the device, command, number of checks
+# per run). In commands, %(url)s stands for the URL of the device,
+# %(state)s for a state directory, %(batch)s for a file listing
+# --targets targets, for mrtg-ubnt-probe.py -B, and %(inventory)s for
+# one listing as many services, for ubnt-passive-checks.py -i.
+SCENARIOS = [
+    ("AF24", "af24",
+     ["UBNT-AF24_http.py", "-H", "%(url)s", "-P", "ubnt"], 1),
+    ("AF24 --stream", "af24",
+     ["UBNT-AF24_http.py", "-H", "%(url)s", "-P", "ubnt", "--stream"], 1),
+    ("M", "airmax",
+     ["UBNT-M_http.py", "-H", "%(url)s", "-P", "ubnt"], 1),
+    ("M --stream", "airmax",
+     ["UBNT-M_http.py", "-H", "%(url)s", "-P", "ubnt", "--stream"], 1),
+    ("M --session-cache", "airmax",
+     ["UBNT-M_http.py", "-H", "%(url)s", "-P", "ubnt", "--session-cache",
+      "--state-dir", "%(state)s"], 1),
+    ("M --cache-ttl", "airmax",
+     ["UBNT-M_http.py", "-H", "%(url)s", "-P", "ubnt", "--cache-ttl", "60",
+      "--state-dir", "%(state)s"], 1),
+    ("M --multipoint", "airmax",
+     ["UBNT-M_http.py", "-H", "%(url)s", "-P", "ubnt", "--multipoint"], 1),
+    ("probe status+sta", "airmax",
+     ["mrtg-ubnt-probe.py", "-H", "%(url)s", "-P", "ubnt",
+      "-k", "status/wireless.signal", "-k", "sta/[0].signal"], 1),
+    ("probe batch", "airmax",
+     ["mrtg-ubnt-probe.py", "-B", "%(batch)s", "-P", "ubnt"], None),
+    ("passive checks M", "airmax",
+     ["ubnt-passive-checks.py", "-i", "%(inventory)s", "-C", "-"], None),
+]
+
+
+def start_server(options, model):
+    """Start fakeubnt.py for model, return (process, URL)"""
+    argv = [options.python, os.path.join(BENCHMARKS_DIR, "fakeubnt.py"),
+            "-m", model, "-s", str(options.stations),
+            "-S", str(options.payload_size), "-l", str(options.latency)]
+    if (options.certfile is not None):
+        argv += ["--certfile", options.certfile]
+    p = subprocess.Popen(argv, stdout=subprocess.PIPE)
+    return (p, p.stdout.readline().strip())
+
+
+def get_stats(url):
+    """Return the request and byte counts of the fake device"""
+    req = urllib2.Request(url + "/_stats")
+    if (url.startswith("https")):
+        import ssl
+        ctx = ssl.create_default_context()
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+        resp = urllib2.urlopen(req, context=ctx)
+    else:
+        resp = urllib2.urlopen(req)
+    try:
+        return json.load(resp)
+    finally:
+        resp.close()
+
+
+def stats_delta(before, after, overhead):
+    return dict((k, after[k] - before[k] - overhead[k]) for k in after)
+
+
+def run(argv):
+    """Run argv, return (seconds, peak RSS in KB, exit status, output)"""
+    out = tempfile.TemporaryFile()
+    start = time.time()
+    p = subprocess.Popen(argv, stdout=out, stderr=subprocess.STDOUT)
+    (pid, status, rusage) = os.wait4(p.pid, 0)
+    elapsed = time.time() - start
+    p.returncode = status
+    out.seek(0)
+    output = out.read()
+    out.close()
+    return (elapsed, rusage.ru_maxrss, os.WEXITSTATUS(status), output)
+
+
+def failed(status, output):
+    """
+    Whether a run failed: a plugin not OK, or an error reported by a
+    script (mrtg-ubnt-probe.py exits with 0) or by a passive check
+    """
+    return (status != 0 or "ERROR" in output or "UNKNOWN" in output)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) / 2]
+
+
+parser = OptionParser(usage="Usage: %prog [options]", description="Run each plugin and script, in each of its modes, against local fake AF24 and AirMAX devices (fakeubnt.py) and report the wall time, requests, bytes transferred (per check) and peak memory (per process).")
+parser.add_option("-n", "--number", type="int", default=5, help="number of runs of each scenario (default: 5)")
+parser.add_option("-p", "--python", default=sys.executable, help="interpreter to run the scripts with (default: %s)" % sys.executable)
+parser.add_option("-d", "--directory", default=os.path.join(BENCHMARKS_DIR, os.pardir), help="directory with the plugins and scripts, e.g. a checkout of another version to compare with (default: the parent directory)")
+parser.add_option("-t", "--targets", type="int", default=20, help="number of targets (services) in batch mode and passive checks (default: 20)")
+parser.add_option("-s", "--stations", type="int", default=1, help="number of stations of the fake AirMAX AP (default: 1)")
+parser.add_option("-S", "--payload-size", type="int", default=0, help="pad status.cgi to this many bytes")
+parser.add_option("-l", "--latency", type="float", default=0, help="milliseconds the fake devices wait before each response (default: 0)")
+parser.add_option("--certfile", help="serve HTTPS, with the certificate and key in this PEM file")
+parser.add_option("-k", "--scenario", action="append", help="run only the scenarios with this name (may be repeated)")
+(options, args) = parser.parse_args()
+
+servers = {}
+tmpdir = tempfile.mkdtemp()
+try:
+    for model in set(model for (name, model, argv, checks) in SCENARIOS):
+        servers[model] = start_server(options, model)
+
+    print "%-20s %7s %9s %9s %9s %10s %11s %8s" % (
+        "scenario", "checks", "ms/check", "conn/chk", "req/check",
+        "KB in/chk", "KB out/chk", "peak MB")
+    for (name, model, argv, checks) in SCENARIOS:
+        if (options.scenario is not None and name not in options.scenario):
+            continue
+        url = servers[model][1]
+        if (not os.path.exists(os.path.join(options.directory, argv[0]))):
+            continue
+
+        state = os.path.join(tmpdir, "state")
+        batch = os.path.join(tmpdir, "batch")
+        inventory = os.path.join(tmpdir, "inventory")
+        f = open(batch, "w")
+        for i in range(options.targets):
+            f.write("target%d -H %s -k status/wireless.signal "
+                    "-k sta/[0].signal\n" % (i, url))
+        f.close()
+        f = open(inventory, "w")
+        for i in range(options.targets):
+            f.write("host%d M M -H %s -P ubnt\n" % (i, url))
+        f.close()
+        if (checks is None):
+            checks = options.targets
+
+        argv = [options.python, os.path.join(options.directory, argv[0])] + \
+            [a % {'url': url, 'state': state, 'batch': batch,
+                  'inventory': inventory} for a in argv[1:]]
+        # Warm up (compile the modules, cache the session)
+        (elapsed, maxrss, status, output) = run(argv)
+        if (failed(status, output)):
+            print "%-20s FAILED (exit status %d): %s" % (name, status,
+                                                         " ".join(argv))
+            print output
+            continue
+
+        # Calibrate for the stats requests themselves
+        overhead = stats_delta(get_stats(url), get_stats(url),
+                               dict.fromkeys(get_stats(url), 0))
+        times = []
+        peak = 0
+        before = get_stats(url)
+        for i in range(options.number):
+            (elapsed, maxrss, status, output) = run(argv)
+            if (failed(status, output)):
+                break
+            times.append(elapsed)
+            peak = max(peak, maxrss)
+        if (failed(status, output)):
+            print "%-20s FAILED (exit status %d) in run %d: %s" % (
+                name, status, i + 1, " ".join(argv))
+            print output
+            continue
+        delta = stats_delta(before, get_stats(url), overhead)
+        runs = float(options.number * checks)
+        print "%-20s %7d %9.1f %9.2f %9.1f %10.1f %11.1f %8.1f" % (
+            name, checks, median(times) / checks * 1e3,
+            delta['connections'] / runs, delta['requests'] / runs,
+            delta['bytes_in'] / runs / 1024, delta['bytes_out'] / runs / 1024,
+            peak / 1024.0)
+finally:
+    for (p, url) in servers.values():
+        p.terminate()
+        p.wait()
+    shutil.rmtree(tmpdir)
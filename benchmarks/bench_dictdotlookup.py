@@ -0,0 +1,138 @@
+#!/usr/bin/python
+
+""" Benchmark DictDotLookup against the previous (eager) implementation """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+import sys
+import gc
+import timeit
+import pprint
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import ubntfixtures
+from DictDotLookup import DictDotLookup, DictDotList
+
+
+class EagerDictDotLookup(object):
+    """DictDotLookup 1.0, copying the whole data on creation"""
+    def __init__(self, d):
+        for k in d:
+            if isinstance(d[k], dict):
+                self.__dict__[k] = EagerDictDotLookup(d[k])
+            elif isinstance(d[k], (list, tuple)):
+                l = []
+                for v in d[k]:
+                    if isinstance(v, dict):
+                        l.append(EagerDictDotLookup(v))
+                    else:
+                        l.append(v)
+                self.__dict__[k] = l
+            else:
+                self.__dict__[k] = d[k]
+
+    def __getitem__(self, name):
+        if name in self.__dict__:
+            return self.__dict__[name]
+
+    def __iter__(self):
+        return iter(self.__dict__.keys())
+
+    def __repr__(self):
+        return pprint.pformat(self.__dict__)
+
+
+def read_af24(data):
+    """The lookups of UBNT-AF24_http.py"""
+    return (data.host.fwversion,
+            data.airfiber.rxpower0, data.airfiber.rxpower1,
+            data.airfiber.rxcapacity, data.airfiber.txcapacity,
+            data.airfiber.txmodrate, data.wireless.distance,
+            data.airfiber.dactemp0, data.airfiber.dactemp1,
+            data.gps.dop, data.gps.sats,
+            data.airfiber.rxpower0valid, data.airfiber.rxpower1valid,
+            data.airfiber.rxoverload0, data.airfiber.rxoverload1,
+            data.gps.status, data.gps.fix, data.airfiber.data_speed,
+            data.airfiber.linkstate, data.interfaces[2].status.speed)
+
+
+def read_airmax(data):
+    """Similar lookups in AirMAX status.cgi data"""
+    return (data.host.fwversion,
+            data.wireless.signal, data.wireless.chainrssi[0],
+            data.wireless.chainrssi[1], data.wireless.noisef,
+            data.wireless.ccq, data.wireless.polling.quality,
+            data.wireless.polling.capacity, data.wireless.txrate,
+            data.wireless.rxrate, data.wireless.count,
+            data.interfaces[1].status.speed)
+
+
+def read_sta(data):
+    """Lookups of the first and last station in AirMAX sta.cgi data"""
+    return (data.sta[0].signal, data.sta[0].airmax.quality,
+            data.sta[-1].signal, data.sta[-1].airmax.quality)
+
+
+def containers(obj, seen):
+    """Add the ids of the dicts and lists reachable from obj to seen"""
+    if (id(obj) in seen or not isinstance(obj, (dict, list))):
+        return
+    seen.add(id(obj))
+    for child in (obj.itervalues() if isinstance(obj, dict) else obj):
+        containers(child, seen)
+
+
+def retained(view, data):
+    """Bytes held by the view (and the copies it made), not shared with data"""
+    shared = set()
+    containers(data, shared)
+    size = 0
+    stack = [view]
+    seen = set()
+    while (len(stack)):
+        obj = stack.pop()
+        if (id(obj) in seen or id(obj) in shared):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(o for o in gc.get_referents(obj)
+                     if isinstance(o, (dict, list, EagerDictDotLookup,
+                                       DictDotLookup, DictDotList)))
+    return size
+
+
+def measure(cls, data, read, number):
+    """Return seconds per view created and read, and bytes kept per view"""
+    seconds = min(timeit.repeat(lambda: read(cls(data)), number=number,
+                                repeat=3)) / number
+
+    view = cls(data)
+    read(view)
+    return (seconds, retained(view, data))
+
+
+parser = OptionParser(usage="Usage: %prog [options]", description="Compare time and memory of DictDotLookup with the previous implementation, which copied the whole data on creation, on recorded AF24 and AirMAX status data.")
+parser.add_option("-n", "--number", type="int", default=2000, help="number of views timed per payload (default: 2000)")
+parser.add_option("-s", "--stations", type="int", default=200, help="number of stations in the AirMAX sta.cgi payload (default: 200)")
+(options, args) = parser.parse_args()
+
+payloads = [
+    ("AF24 status.cgi", ubntfixtures.load("af24-status"), read_af24),
+    ("AirMAX AP status.cgi", ubntfixtures.ap_status(options.stations),
+     read_airmax),
+    ("AirMAX AP sta.cgi (%d stations)" % options.stations,
+     {'sta': ubntfixtures.stations(options.stations)}, read_sta),
+]
+
+print "%-32s %-16s %12s %14s" % ("payload", "class", "usec/view", "bytes/view")
+for (name, data, read) in payloads:
+    for cls in (EagerDictDotLookup, DictDotLookup):
+        number = options.number
+        if (cls is EagerDictDotLookup and name.endswith("stations)")):
+            number = max(1, number / 20)
+        (seconds, size) = measure(cls, data, read, number)
+        print "%-32s %-16s %12.1f %14.0f" % (name, cls.__name__,
+                                              seconds * 1e6, size)
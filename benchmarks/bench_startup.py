@@ -0,0 +1,112 @@
+#!/usr/bin/python
+
+""" Benchmark the startup time of the plugins and scripts """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+import re
+import sys
+import time
+import socket
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+# The entry points, with the arguments to make their first request to
+# http(s)://127.0.0.1:<port> (%(url)s), or run as a passive checks with
+# an inventory for it (%(inventory)s)
+ENTRY_POINTS = [
+    ("UBNT-AF24_http.py", ["-H", "%(url)s", "-P", "ubnt"]),
+    ("UBNT-M_http.py", ["-H", "%(url)s", "-P", "ubnt"]),
+    ("mrtg-ubnt-probe.py", ["-H", "%(url)s", "-P", "ubnt",
+                            "-k", "status/host.fwversion"]),
+    ("ubnt-passive-checks.py", ["-i", "%(inventory)s", "-C", "-"]),
+]
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) / 2]
+
+
+def run(argv):
+    """Return the seconds taken by the command"""
+    start = time.time()
+    subprocess.call(argv, stdout=open(os.devnull, 'w'))
+    return time.time() - start
+
+
+def count_modules(python, script):
+    """Return the number of modules imported by script -V"""
+    p = subprocess.Popen([python, "-v", script, "-V"],
+                         stdout=open(os.devnull, 'w'), stderr=subprocess.PIPE)
+    (out, err) = p.communicate()
+    return len(re.findall(r'^import \w', err, re.M))
+
+
+def run_first_request(python, script, args, listener):
+    """Return the seconds until script connects to listener"""
+    start = time.time()
+    p = subprocess.Popen([python, script] + args,
+                         stdout=open(os.devnull, 'w'),
+                         stderr=open(os.devnull, 'w'))
+    try:
+        listener.settimeout(30)
+        (conn, address) = listener.accept()
+        elapsed = time.time() - start
+        # The script fails right away; close any further connections
+        # (e.g. to logout) as well, until it exits
+        conn.close()
+        listener.settimeout(0.1)
+        while (p.poll() is None):
+            try:
+                listener.accept()[0].close()
+            except socket.timeout:
+                pass
+    finally:
+        p.wait()
+    return elapsed
+
+
+parser = OptionParser(usage="Usage: %prog [options]", description="Measure the startup of each plugin and script: the time to run with -V (i.e. imports and option parsing), the number of modules it imports, and the time until it opens its first connection to a device (a local socket that accepts it and closes it).")
+parser.add_option("-n", "--number", type="int", default=10, help="number of runs of each entry point (default: 10)")
+parser.add_option("-p", "--python", default=sys.executable, help="interpreter to run the entry points with (default: %s)" % sys.executable)
+parser.add_option("-d", "--directory", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir), help="directory with the entry points, e.g. a checkout of another version to compare with (default: the parent directory)")
+parser.add_option("--https", action="store_true", help="connect with https:// instead of http://")
+(options, args) = parser.parse_args()
+
+listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+listener.bind(("127.0.0.1", 0))
+listener.listen(5)
+url = "%s://127.0.0.1:%d" % ("https" if options.https else "http",
+                             listener.getsockname()[1])
+
+(fd, inventory) = tempfile.mkstemp()
+os.write(fd, "bench bench M -H %s -P ubnt\n" % url)
+os.close(fd)
+
+bare = [run([options.python, "-c", "pass"]) for i in range(options.number)]
+print "%-24s %16s %16s %8s %16s" % ("entry point", "-V ms (min)", "-V ms (median)", "modules", "1st conn ms (med)")
+print "%-24s %16.1f %16.1f %8s %16s" % ("(python -c pass)", min(bare) * 1e3, median(bare) * 1e3, "", "")
+try:
+    for (script, script_args) in ENTRY_POINTS:
+        script = os.path.join(options.directory, script)
+        if (not os.path.exists(script)):
+            continue
+        script_args = [a % {'url': url, 'inventory': inventory}
+                       for a in script_args]
+        # Warm up the OS caches and compile the modules
+        run([options.python, script, "-V"])
+        version = [run([options.python, script, "-V"])
+                   for i in range(options.number)]
+        first = [run_first_request(options.python, script, script_args,
+                                   listener)
+                 for i in range(options.number)]
+        print "%-24s %16.1f %16.1f %8d %16.1f" % (
+            os.path.basename(script), min(version) * 1e3,
+            median(version) * 1e3, count_modules(options.python, script),
+            median(first) * 1e3)
+finally:
+    os.unlink(inventory)
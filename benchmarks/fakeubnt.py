@@ -0,0 +1,255 @@
+#!/usr/bin/python
+
+""" A stand-in for the web interface of UBNT devices, for benchmarks """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+import sys
+import cgi
+import time
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from optparse import OptionParser
+if sys.version_info < (2, 6):
+    import simplejson as json
+else:
+    import json
+
+import ubntfixtures
+
+STATS_PATH = "/_stats"
+
+
+class CountingFile(object):
+    """A file-like wrapper counting the bytes read from or written to it"""
+    def __init__(self, f, counter):
+        self.f = f
+        self.counter = counter
+
+    def read(self, *args):
+        data = self.f.read(*args)
+        self.counter(len(data))
+        return data
+
+    def readline(self, *args):
+        data = self.f.readline(*args)
+        self.counter(len(data))
+        return data
+
+    def write(self, data):
+        self.counter(len(data))
+        return self.f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+class FakeUBNTHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Emulates the login, logout and data sources (/<source>.cgi) of the
+    web interface, as far as the plugins and scripts use them.
+    """
+    protocol_version = "HTTP/1.1"
+    # Buffer each response and send it at once, like a real web server,
+    # rather than a segment per header line
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.rfile = CountingFile(self.rfile, self.server.count_in)
+        self.wfile = CountingFile(self.wfile, self.server.count_out)
+
+    def log_message(self, format, *args):
+        if (self.server.verbose):
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+    def session(self):
+        for cookie in self.headers.getheaders("Cookie"):
+            for part in cookie.split(";"):
+                (name, sep, value) = part.strip().partition("=")
+                if (name == "AIROS_SESSIONID"):
+                    return value
+
+    def respond(self, code, body="", content_type="text/html", headers=()):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for (name, value) in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        if (self.command != "HEAD"):
+            self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse.urlparse(self.path).path
+        if (path == STATS_PATH):
+            # Not counting the connection of the stats request itself
+            self.server.count_connection(-1)
+            return self.respond(200, json.dumps(self.server.get_stats()),
+                                "application/json")
+
+        self.server.count_request()
+        if (self.server.latency):
+            time.sleep(self.server.latency)
+
+        if (path == "/login.cgi"):
+            session = os.urandom(16).encode("hex")
+            return self.respond(200, "<html>login</html>", headers=[
+                ("Set-Cookie", "AIROS_SESSIONID=%s; Path=/" % session)])
+        if (path == "/logout.cgi"):
+            self.server.sessions.discard(self.session())
+            return self.respond(302, headers=[("Location", "/login.cgi")])
+        if (self.session() not in self.server.sessions):
+            return self.respond(302, headers=[
+                ("Location", "/login.cgi?uri=" + path)])
+
+        if (path == "/index.cgi"):
+            return self.respond(200, "<html>main</html>")
+        source = self.server.sources.get(path)
+        if (source is None):
+            return self.respond(404, "<html>not found</html>")
+        (body, content_type) = source
+        return self.respond(200, body, content_type)
+
+    def do_POST(self):
+        self.server.count_request()
+        if (self.server.latency):
+            time.sleep(self.server.latency)
+
+        path = urlparse.urlparse(self.path).path
+        length = int(self.headers.getheader("Content-Length", 0))
+        body = self.rfile.read(length)
+        if (path != "/login.cgi"):
+            return self.respond(404, "<html>not found</html>")
+
+        (content_type, params) = cgi.parse_header(
+            self.headers.getheader("Content-Type", ""))
+        fields = {}
+        if (content_type == "multipart/form-data"):
+            import cStringIO
+            fields = cgi.parse_multipart(cStringIO.StringIO(body), params)
+        username = fields.get("username", [None])[0]
+        password = fields.get("password", [None])[0]
+        session = self.session()
+        if (session is None or username != self.server.username or
+                password != self.server.password):
+            return self.respond(200, "<html>invalid credentials</html>")
+        self.server.sessions.add(session)
+        uri = fields.get("uri", ["/index.cgi"])[0]
+        return self.respond(302, headers=[("Location", uri)])
+
+
+class FakeUBNTServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, sources, username="ubnt", password="ubnt",
+                 latency=0, certfile=None, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeUBNTHandler)
+        if (certfile is not None):
+            import ssl
+            self.socket = ssl.wrap_socket(self.socket, certfile=certfile,
+                                          server_side=True)
+        self.sources = sources
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.verbose = verbose
+        self.sessions = set()
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'bytes_in': 0, 'bytes_out': 0,
+                      'connections': 0}
+
+    def count_connection(self, n=1):
+        with self.lock:
+            self.stats['connections'] += n
+
+    def count_request(self):
+        with self.lock:
+            self.stats['requests'] += 1
+
+    def count_in(self, n):
+        with self.lock:
+            self.stats['bytes_in'] += n
+
+    def count_out(self, n):
+        with self.lock:
+            self.stats['bytes_out'] += n
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def handle_error(self, request, client_address):
+        # Clients dropping (keep-alive) connections are no errors here
+        if (self.verbose):
+            BaseHTTPServer.HTTPServer.handle_error(self, request,
+                                                   client_address)
+
+    def process_request(self, request, client_address):
+        self.count_connection()
+        SocketServer.ThreadingMixIn.process_request(self, request,
+                                                    client_address)
+
+
+def build_sources(model, stations=1, payload_size=0):
+    """
+    Return the data sources of a device of model (af24 or airmax), as
+    {path: (body, content type)}. status.cgi is padded to payload_size
+    bytes, if it is smaller.
+    """
+    if (model == "af24"):
+        status = ubntfixtures.load("af24-status")
+    else:
+        status = ubntfixtures.ap_status(stations)
+    body = json.dumps(status)
+    if (len(body) < payload_size):
+        # Padding at the start of the document, as it has to be read
+        # (or skipped) before any useful data
+        pad = json.dumps({"padding": "x" * (payload_size - len(body))})
+        body = pad[:-1] + ", " + body[1:]
+    sources = {
+        "/status.cgi": (body, "application/json"),
+        "/iflist.cgi": (json.dumps({"interfaces": status["interfaces"]}),
+                        "application/json"),
+    }
+    if (model != "af24"):
+        # AirOS serves sta.cgi as text/html
+        sources["/sta.cgi"] = (json.dumps(ubntfixtures.stations(stations)),
+                               "text/html")
+    return sources
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="Usage: %prog [options]", description="Serve recorded AF24 or AirMAX data like the web interface of a UBNT device: login.cgi (with the redirect to the uri posted), session cookies, logout.cgi, status.cgi, iflist.cgi and sta.cgi (AirMAX). Request and byte counts are served as JSON at " + STATS_PATH + ".")
+    parser.add_option("-a", "--address", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_option("-p", "--port", type="int", default=0, help="port to listen on (default: any free port)")
+    parser.add_option("-m", "--model", type="choice", choices=["af24", "airmax"], default="airmax", help="af24 or airmax (default: airmax)")
+    parser.add_option("-s", "--stations", type="int", default=1, help="number of stations of the AirMAX AP (default: 1)")
+    parser.add_option("-S", "--payload-size", type="int", default=0, help="pad status.cgi to this many bytes")
+    parser.add_option("-l", "--latency", type="float", default=0, help="milliseconds to wait before each response (default: 0)")
+    parser.add_option("-U", "--username", default="ubnt", help="username (default: ubnt)")
+    parser.add_option("-P", "--password", default="ubnt", help="password (default: ubnt)")
+    parser.add_option("--certfile", help="serve HTTPS, with the certificate and key in this PEM file")
+    parser.add_option("-v", "--verbose", action="store_true", help="log requests")
+    (options, args) = parser.parse_args()
+
+    server = FakeUBNTServer((options.address, options.port),
+                            build_sources(options.model, options.stations,
+                                          options.payload_size),
+                            options.username, options.password,
+                            options.latency / 1000.0, options.certfile,
+                            options.verbose)
+    # The URL is the first line of output, for the benchmarks to read
+    print "%s://%s:%d" % ("https" if options.certfile else "http",
+                          options.address, server.server_address[1])
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,56 @@
+""" Recorded data of UBNT devices, for benchmarks """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+import sys
+import copy
+if sys.version_info < (2, 6):
+    import simplejson as json
+else:
+    import json
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "fixtures")
+
+
+def load(name):
+    """Return the parsed fixtures/<name>.json"""
+    f = open(os.path.join(FIXTURES_DIR, name + ".json"))
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+
+def stations(count):
+    """
+    Return sta.cgi data of an AirMAX AP with count stations, derived
+    from the recorded station with varying address, signal and rates.
+    """
+    template = load("airmax-sta-station")
+    data = []
+    for i in range(count):
+        station = copy.deepcopy(template)
+        station['mac'] = "24:A4:3C:%02X:%02X:%02X" % (
+            (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff)
+        station['lastip'] = "10.%d.%d.%d" % (
+            (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff)
+        station['associd'] = i + 1
+        station['signal'] = -55 - (i * 7) % 30
+        station['rssi'] = 96 + station['signal']
+        station['ccq'] = 100 - (i * 3) % 40
+        station['tx'] = 270 - (i * 27) % 216
+        station['rx'] = 243 - (i * 13) % 189
+        station['airmax']['quality'] = 95 - (i * 5) % 60
+        station['airmax']['capacity'] = 90 - (i * 11) % 70
+        station['remote']['hostname'] = "cpe-%04d" % (i + 1)
+        data.append(station)
+    return data
+
+
+def ap_status(count):
+    """Return status.cgi data of an AirMAX AP with count stations."""
+    data = load("airmax-ap-status")
+    data['wireless']['count'] = count
+    return data
@@ -6,78 +6,56 @@ __author__ = "Zenon Mousmoulas"
 
 import os
 import sys
-import socket
-import traceback
-import urllib2
-import cookielib
-if sys.version_info < (2, 6):
-	import simplejson as json
-else:
-	import json
 from optparse import OptionParser, OptionValueError, OptionGroup
-from MultiPartForm import MultiPartForm
-import re
-
-def dot_to_dict(key):
-    """
-    Convert dotted notation (object.attribute) to the equivalent
-    dict/list syntax. This specifically targets access to objects
-    (nested dict/list data structures) returned by json.loads().
-    """
-    retkey = []
-    # split at '.' boundaries
-    for part in key.split('.'):
-        # ONLY match key[int_index_or_slice] or [int_index_or_slice]
-        key_idx_match = re.search('^([^\[\]]+)?(\[[:\d]+\])$', part)
-        if key_idx_match:
-            part = ''
-            if key_idx_match.group(1) is not None:
-                part += "['%s']" % key_idx_match.group(1)
-            part += key_idx_match.group(2)
-        else:
-            part = "['%s']" % part
-        retkey.append(part)
-    return ''.join(retkey)
-
-
-# Setup argument handler
-parser = OptionParser (usage="Usage: %prog -H <httphost> [-U <username>] -P <password> -k <source>/<key> [options]", description="MRTG probe for UBNT devices (over HTTP)", epilog=None)
-parser.add_option ("-V", "--version", action="store_true", help="show the version and exit")
-parser.add_option ("-v", "--verbose", action="count", help="show debugging information")
-parser.add_option ("-t", "--timeout", type="int", default=10, help="seconds before plugin times out (default: 10)")
-
-connGroup = OptionGroup (parser, "Connection options")
-connGroup.add_option ("-H", "--httphost", help="HTTP(S) protocol, hostname, port (optional), as URL, e.g: http://example.com:port, https://example.com etc.")
-parser.add_option_group (connGroup)
-
-authGroup = OptionGroup (parser, "Authentication options")
-authGroup.add_option ("-U", "--username", default="ubnt", help="username (default: 'ubnt')")
-authGroup.add_option ("-P", "--password", help="password")
-parser.add_option_group (authGroup)
-
-dataGroup = OptionGroup (parser, "Options for data sources and values returned by the program")
-dataGroup.add_option("-k", "--source-key", action="append", help="This option should be used as many times as the number of values to be returned by the program. It must be followed by exactly two (2) arguments, joined with '/': the source of data the program will poll and the key for the value to be probed. The first argument will be used to construct the URL to be requested through HTTP from the device (GET /<source>.cgi). For the second argument, any key that appears in the selected data source may be given, using dotted notation to perform nested lookups in JSON data structures. Example: -k stats/airfiber.txcapacity -k stats/airfiber.rxcapacity")
-dataGroup.add_option("-e", "--expression", action="append", help="Specify an optional expression [to be interpreted by Python using eval()] that shall be used to modify the corresponding value before it is returned. This option must be used as many times as the number of source-key options, so that expressions are matched with keys. Any occurences of VAL in an expression will be replaced by the corresponding value. If an empty string is given, processing is skipped for the corresponding value. Example: -e \"VAL*1000\" \"VAL/1000\"")
-parser.add_option_group (dataGroup)
-
-outputGroup = OptionGroup (parser, "Options for data output")
-outputGroup.add_option("-f", "--output-format", type="choice", choices=["MRTG"], default="MRTG", help="Choose an output format for values returned by the program, available options are: MRTG (default): Print each value on a new line, MRTG expects two values.")
-parser.add_option_group(outputGroup)
-
-try:
-	(options, args) = parser.parse_args()
-	verbose = options.verbose
-
-	if (options.version):
-		print "%s %s" % (os.path.basename (sys.argv[0]), __version__)
-		sys.exit()
-
-	# Validate arguments
-	if (options.httphost is None):
-		parser.error ("-H/--httphost is required")
-
-	if (options.password is None):
-		parser.error ("-P/--password option is required")
+from UBNTClient import UBNTClient
+from KeyPath import KeyPath
+
+# Formats written by write_lines(), rather than printed by output()
+LINE_FORMATS = ("GRAPHITE", "INFLUX")
+# Targets with the same values of these options are polled together in
+# batch mode
+POLL_OPTIONS = ('httphost', 'username', 'password', 'verbose', 'timeout', 'stream', 'keepalive', 'timing', 'session_cache', 'state_dir', 'cache_ttl', 'circuit_failures', 'circuit_cooldown', 'max_sessions', 'request_spacing', 'platform', 'plan')
+
+class TargetParser (OptionParser):
+	"""Parse target lines in batch mode, raising errors instead of exiting"""
+	def error (self, msg):
+		raise OptionValueError (msg)
+
+def build_parser(cls=OptionParser):
+	"""Setup argument handler"""
+	parser = cls (usage="Usage: %prog -H <httphost> [-U <username>] -P <password> -k <source>/<key> [options]\n       %prog -B <file> [-U <username>] [-P <password>] [options]", description="MRTG probe for UBNT devices (over HTTP)", epilog=None)
+	parser.add_option ("-V", "--version", action="store_true", help="show the version and exit")
+	parser.add_option ("-v", "--verbose", action="count", help="show debugging information")
+	parser.add_option ("-t", "--timeout", type="int", default=10, help="seconds before polling a target times out, for all its requests together (default: 10)")
+
+	UBNTClient.add_options (parser)
+
+	dataGroup = OptionGroup (parser, "Options for data sources and values returned by the program")
+	dataGroup.add_option("-k", "--source-key", action="append", help="This option should be used as many times as the number of values to be returned by the program. It must be followed by exactly two (2) arguments, joined with '/': the source of data the program will poll and the key for the value to be probed. The first argument will be used to construct the URL to be requested through HTTP from the device (GET /<source>.cgi); with --plan, a cheaper source providing the same key may be requested instead. For the second argument, any key that appears in the selected data source may be given, using dotted notation to perform nested lookups in JSON data structures. Example: -k stats/airfiber.txcapacity -k stats/airfiber.rxcapacity")
+	dataGroup.add_option("--plan", action="store_true", help="fetch the cheapest data sources providing the keys given with -k (e.g. status rather than iflist, if status is fetched anyway, or iflist rather than status for interfaces alone), rather than exactly the sources given; shown with -v")
+	dataGroup.add_option("--platform", type="choice", choices=["AF24", "M"], help="platform of the device (AF24 or M), for the sizes and keys of its data sources with --plan (default: any)")
+	dataGroup.add_option("-e", "--expression", action="append", help="Specify an optional expression that shall be used to modify the corresponding value before it is returned. This option must be used as many times as the number of source-key options, so that expressions are matched with keys. VAL in an expression stands for the corresponding value. Expressions use Python syntax, but only arithmetic and comparison operators, and/or/not, conditionals (x if c else y), dict/list/tuple literals and subscripts (for lookup tables), the functions min, max, abs, round, int, float, str, len, step(VAL, {key: value...}) (the value for the largest key less than VAL) and string methods such as VAL.rstrip('x') are allowed. If an empty string is given, processing is skipped for the corresponding value. Example: -e \"VAL*1000\" -e \"VAL/1000\"")
+	parser.add_option_group (dataGroup)
+
+	outputGroup = OptionGroup (parser, "Options for data output")
+	outputGroup.add_option("-f", "--output-format", type="choice", choices=["MRTG", "RRD", "GRAPHITE", "INFLUX"], default="MRTG", help="Choose an output format for values returned by the program, available options are: MRTG (default): Print each value on a new line, MRTG expects two values. RRD: Update an RRD file (--rrd-file) with all values, one data source for each key, named after the end of the key (e.g. wireless_signal for status/wireless.signal, sta_0_signal for sta/[0].signal); the file is created if it does not exist. In batch mode, the files of all targets are updated at once, after polling. GRAPHITE: Write a line in Graphite plaintext protocol for each value, named <prefix>.<key>, tagged with the host (from -H) and the source. INFLUX: Write a line in InfluxDB line protocol for each source, as measurement <prefix>, tagged with the host and the source, with the keys as fields. With GRAPHITE and INFLUX, all lines (of all targets, in batch mode) are written to --output at once, along with any --timing values, as source timing.")
+	outputGroup.add_option("-o", "--output", default="-", help="where to write lines with -f GRAPHITE or INFLUX: - for standard output (default), tcp://host:port, udp://host:port, unix:<path> for a local stream socket or a file, which is appended to")
+	outputGroup.add_option("--prefix", default="ubnt", help="prefix of metric names with -f GRAPHITE, measurement name with -f INFLUX (default: ubnt)")
+	outputGroup.add_option("--rrd-file", help="RRD file to update with -f RRD")
+	outputGroup.add_option("--rrd-step", type="int", default=300, help="seconds between updates of RRD files created with -f RRD (default: 300)")
+	outputGroup.add_option("--rrd-type", type="choice", choices=["GAUGE", "COUNTER", "DERIVE", "ABSOLUTE"], action="append", help="type of the data sources of RRD files created with -f RRD: GAUGE (default), COUNTER, DERIVE or ABSOLUTE. This option may be used once for all data sources, or as many times as the source-key option, so that types are matched with keys.")
+	parser.add_option_group(outputGroup)
+
+	batchGroup = OptionGroup (parser, "Options for batch mode")
+	batchGroup.add_option("-B", "--batch", help="Poll all targets listed in the given file ('-' for standard input) concurrently, instead of a single target. Each line must begin with a name for the target, followed by the options for that target, as they would be given on the command line (e.g. -H, -k and -e); options given on the command line (e.g. -U and -P) apply to all targets, unless overridden. Empty lines and lines starting with # are ignored. Values are printed grouped per target, after a line with the target name in square brackets.")
+	batchGroup.add_option("-W", "--workers", type="int", default=10, help="maximum number of targets polled concurrently in batch mode (default: 10)")
+	parser.add_option_group(batchGroup)
+
+	return parser
+
+def check_options(parser, options):
+	"""Validate arguments for a single target"""
+	UBNTClient.check_options (parser, options)
 
 	if (options.source_key is None):
 		parser.error ("-k/--source-key option is required")
@@ -89,119 +67,310 @@ try:
 
 	if ((options.expression is not None) and (len(options.expression) != len(options.source_key))):
 		parser.error ("-e/--expression option must be used as many times as the -k/--source-key option")
-
-	# Prepare login
-	form = MultiPartForm()
-	form.add_field('username', options.username)
-	form.add_field('password', options.password)
-	form.add_field('Submit', 'Login')
-	# We need session cookies
-	cj = cookielib.LWPCookieJar()
-	opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cj))
-	urllib2.install_opener(opener)
-	# Shortcuts...
-	urlopen = urllib2.urlopen
-	Request = urllib2.Request
-	# Set timeout for requests
-	socket.setdefaulttimeout(10)
-
-	# Must get a session cookie first
-	req = Request(options.httphost + '/login.cgi')
-	if (verbose >= 2):
-		print "Opening session"
-	resp = urlopen(req)
-	# Post the form to login
-	form.add_field('uri', '/index.cgi')
-	body = str(form)
-	req = Request(options.httphost + '/login.cgi')
-	req.add_header('Content-type', form.get_content_type())
-	req.add_header('Content-length', len(body))
-	req.add_data(body)
-	if (verbose >= 2):
-		print "Logging in"
-	resp = urlopen(req)
-	# Check we reached the right page after redirection post login
-	if (resp.geturl() != options.httphost + '/index.cgi'):
-		if (verbose >= 2):
-			print "Login may have failed"
-		raise Exception("reached a wrong page: " + resp.geturl())
-
-	# Avoid leaving open sessions
-	def sessionclose():
-		req = Request(options.httphost + '/logout.cgi')
-		if (verbose >= 2):
-			print "Logging out"
-		resp = urlopen(req)
-
-	data = {}
-	datasourceuri = {}
-	# Poll data sources (only once for each data source)
-	for source in set([s for (s, k) in options.source_key]):
-		datasourceuri[source] = "/%s.cgi" % source
-
-		req = Request(options.httphost + datasourceuri[source])
-		if (verbose >= 2):
-			print "Collecting data (%s)" % datasourceuri[source]
-		resp = urlopen(req)
-
-		# Check we reached the right page after redirection post login
-		if (resp.geturl() != options.httphost + datasourceuri[source]):
-			raise Exception("reached a wrong page: " + resp.geturl())
-
-		# Check content-type (last resort) before passing to JSON parser
-		contype = resp.info()['Content-type']
-		if (contype != "application/json"):
-			# sta.cgi on AirOS returns text/html
-			if ((source == 'sta') and (contype =='text/html')):
-				pass
-			else:
-				raise Exception("response has wrong content-type: " + contype)
-
-		data[source] = json.load(resp)
-
-	sessionclose()
+	if (options.expression is not None):
+		from Expression import Expression
+		for expression in options.expression:
+			if (expression):
+				try:
+					Expression.compile(expression)
+				except ValueError, e:
+					parser.error ("-e/--expression: %s" % e)
+
+	if (options.output_format == "RRD"):
+		if (options.rrd_file is None):
+			parser.error ("--rrd-file option is required with -f RRD")
+		if ((options.rrd_type is not None) and (len(options.rrd_type) not in (1, len(options.source_key)))):
+			parser.error ("--rrd-type option must be used once, or as many times as the -k/--source-key option")
+
+def poll(options, source_keys):
+	"""
+	Poll a target for the (source, key) pairs given and return the data
+	to read each pair from, as (source, data) in a dict by pair, along
+	with the PhaseTimer of the client (None unless --timing). With
+	--plan, only the cheapest sources providing all the keys are
+	fetched (see QueryPlanner).
+	"""
+	if (options.plan):
+		from QueryPlanner import plan
+		(sources, reads) = plan(source_keys, options.platform)
+		if (options.verbose):
+			for (source, key) in source_keys:
+				if (reads[(source, key)] != source):
+					print "Reading %s/%s from /%s.cgi" % (source, key, reads[(source, key)])
+	else:
+		sources = [s for (s, k) in source_keys]
+		reads = dict((pair, pair[0]) for pair in source_keys)
+
+	client = UBNTClient.from_options (options)
+
+	# Poll data sources (only once for each data source, concurrently),
+	# the first one through the login itself
+	keys = None
+	if (options.stream):
+		keys = {}
+		for pair in source_keys:
+			keys.setdefault(reads[pair], []).append(pair[1])
+	data = client.collect(sources, keys)
 
 	if (not len (data)):
 		raise Exception("no valid sources or no data collected from sources")
+	return (dict((pair, (source, data[source])) for (pair, source) in reads.items()), client.timer)
 
-	# Process keys
+def extract(options, found):
+	"""Return the list of values of a target, from the data found by poll()"""
 	returndata = []
 	for i, (source, key) in enumerate(options.source_key):
 		if (not len (key)):
 			raise Exception("invalid key (empty string)")
 
-		# if-else one-liner covers the case
-		# the key starts with a list item
-		source_key = '%s%s' % (source,
-				       key if key.startswith('[') else '.' + key)
-
-		source_key = 'data' + dot_to_dict(source_key)
-
 		# Attempt to find key in data source
+		(fetched, source_data) = found[(source, key)]
 		try:
-			key_data = eval (source_key)
-		except (KeyError, IndexError):
+			key_data = KeyPath.compile(key).get(source_data)
+		except (KeyError, IndexError, TypeError):
 			raise Exception("%s not found in data source (URL: %s)" %
-					(key, options.httphost + datasourceuri[source]))
+					(key, "%s/%s.cgi" % (options.httphost, fetched)))
 
 		# Massage value with expression
 		if (options.expression is not None):
 			expression = options.expression[i]
 			if (expression):
-				expression = expression.replace("VAL", "key_data")
-				key_data = eval (expression)
+				from Expression import Expression
+				key_data = Expression.compile(expression)(key_data)
 
 		returndata.append(key_data)
 
-	# Return values
+	return returndata
+
+def probe(options):
+	"""
+	Poll a single target and return the list of values, along with the
+	PhaseTimer of the client (None unless --timing)
+	"""
+	(found, timer) = poll(options, options.source_key)
+	return (extract(options, found), timer)
+
+def output(options, returndata, timer=None):
+	"""Return values (and timings, in a section of their own)"""
 	if (options.output_format == "MRTG"):
 		for val in returndata:
 			print val
+	if (timer is not None):
+		print "# timing"
+		for (label, value, UOM) in timer.items():
+			print "%s=%s%s" % (label, value, UOM)
+
+def write_rrd(targets):
+	"""
+	Update the RRD files of the targets, [(options, values)], all at
+	once, and return the errors in a dict by file
+	"""
+	if (not len (targets)):
+		return {}
+	from RRDWriter import RRDWriter, ds_names
+
+	rrd = RRDWriter()
+	errors = {}
+	for (options, values) in targets:
+		types = options.rrd_type or ["GAUGE"]
+		if (len (types) == 1):
+			types = types * len (options.source_key)
+		ds = zip(ds_names(options.source_key), types)
+		try:
+			rrd.update(options.rrd_file, ds, values, options.rrd_step)
+		except Exception, e:
+			errors[options.rrd_file] = str(e)
+	errors.update(rrd.flush())
+	return errors
+
+def format_lines(options, returndata, timer=None):
+	"""
+	Return the values (and timings) of a target as lines in the format
+	of -f GRAPHITE or INFLUX
+	"""
+	import urlparse
+	from LineProtocol import graphite_lines, influx_lines
+
+	host = urlparse.urlparse(options.httphost).hostname or options.httphost
+	items = [(source, key, value) for ((source, key), value) in zip(options.source_key, returndata)]
+	if (timer is not None):
+		items += [("timing", label, float(value) if UOM == "s" else int(value)) for (label, value, UOM) in timer.items()]
+	if (options.output_format == "GRAPHITE"):
+		return graphite_lines(options.prefix, host, items)
+	return influx_lines(options.prefix, host, items)
+
+def write_lines(targets):
+	"""
+	Write the lines of the targets, [(id, options, result)], with a
+	single write to each output, and return the errors in a dict by id;
+	the timings of a poll shared by several targets are written once,
+	with the lines of the first one
+	"""
+	from LineProtocol import write
+
+	outputs = {}
+	errors = {}
+	timers = set()
+	for (i, options, (returndata, timer)) in targets:
+		if (id(timer) in timers):
+			timer = None
+		try:
+			lines = format_lines(options, returndata, timer)
+		except Exception, e:
+			errors[i] = e
+			continue
+		if (timer is not None):
+			timers.add(id(timer))
+		outputs.setdefault(options.output, ([], []))
+		outputs[options.output][0].extend(lines)
+		outputs[options.output][1].append(i)
+	for (dest, (lines, indexes)) in outputs.items():
+		try:
+			write(dest, "".join(lines))
+		except Exception, e:
+			for i in indexes:
+				errors[i] = e
+	return errors
+
+def read_targets(options):
+	"""Parse the targets listed in the batch file, as (name, options)"""
+	import copy
+	import shlex
+
+	target_parser = build_parser(TargetParser)
+	targets = []
+	f = sys.stdin if (options.batch == '-') else open(options.batch)
+	try:
+		for lineno, line in enumerate(f):
+			args = shlex.split(line, comments=True)
+			if (not len (args)):
+				continue
+			target_options = copy.copy(options)
+			target_options.source_key = None
+			target_options.expression = None
+			target_options.rrd_type = None
+			try:
+				(target_options, target_args) = target_parser.parse_args(args[1:], target_options)
+				check_options(target_parser, target_options)
+			except OptionValueError, e:
+				raise Exception("%s, line %d: %s" % (options.batch, lineno + 1, e))
+			targets.append((args[0], target_options))
+	finally:
+		if (f is not sys.stdin):
+			f.close()
+	return targets
+
+def failed(options, e):
+	"""The result of a target in batch mode that failed with e"""
+	if (options.verbose >= 2):
+		import traceback
+		traceback.print_exc(e)
+	return (None, e)
+
+def probe_device(targets):
+	"""
+	Poll a device once for the keys of all its targets in batch mode,
+	[(name, options)], returning the values or the error of each one
+	"""
+	options = targets[0][1]
+	source_keys = []
+	for (name, target_options) in targets:
+		source_keys.extend(pair for pair in target_options.source_key if pair not in source_keys)
+	try:
+		(found, timer) = poll(options, source_keys)
+	except Exception, e:
+		return [failed(options, e)] * len (targets)
+
+	results = []
+	for (name, target_options) in targets:
+		try:
+			results.append(((extract(target_options, found), timer), None))
+		except Exception, e:
+			results.append(failed(target_options, e))
+	return results
+
+def batch(options):
+	"""Poll all targets concurrently and print values grouped per target"""
+	from multiprocessing.pool import ThreadPool
+
+	targets = read_targets(options)
+	if (not len (targets)):
+		return
+
+	# Targets of the same device, polled the same way, share a single
+	# poll (see POLL_OPTIONS)
+	devices = []
+	indexes = {}
+	for (i, (name, target_options)) in enumerate(targets):
+		key = tuple(getattr(target_options, option) for option in POLL_OPTIONS)
+		if (key not in indexes):
+			indexes[key] = []
+			devices.append(indexes[key])
+		indexes[key].append(i)
+
+	pool = ThreadPool(max(1, min(options.workers, len (devices))))
+	try:
+		polled = pool.map(probe_device, [[targets[i] for i in device] for device in devices])
+	finally:
+		pool.close()
+	results = [None] * len (targets)
+	for (device, device_results) in zip(devices, polled):
+		for (i, result) in zip(device, device_results):
+			results[i] = result
+
+	# Lines of all targets are written at once, errors are reported on
+	# standard error so as not to mix them with lines on standard output
+	line_targets = [(i, target_options, result) for (i, ((name, target_options), (result, error))) in enumerate(zip(targets, results)) if target_options.output_format in LINE_FORMATS]
+	line_errors = write_lines([t for t in line_targets if t[2] is not None])
+	for (i, target_options, result) in line_targets:
+		e = results[i][1] or line_errors.get(i)
+		if (e is not None):
+			print >> sys.stderr, "[%s] ERROR: %s" % (targets[i][0], str(e))
+
+	rrd_errors = write_rrd([(target_options, result[0]) for ((name, target_options), (result, error)) in zip(targets, results) if (error is None and target_options.output_format == "RRD")])
+
+	for ((name, target_options), (result, e)) in zip(targets, results):
+		if (target_options.output_format in LINE_FORMATS):
+			continue
+		print "[%s]" % name
+		if (e is None and target_options.output_format == "RRD" and
+				target_options.rrd_file in rrd_errors):
+			e = Exception(rrd_errors[target_options.rrd_file])
+		if (e is not None):
+			print "ERROR: %s" % str(e)
+		else:
+			output(target_options, *result)
+
+
+parser = build_parser()
+verbose = None
+try:
+	(options, args) = parser.parse_args()
+	verbose = options.verbose
+
+	if (options.version):
+		print "%s %s" % (os.path.basename (sys.argv[0]), __version__)
+		sys.exit()
+
+	if (options.batch is not None):
+		batch(options)
+	else:
+		# Validate arguments
+		check_options(parser, options)
+		result = probe(options)
+		if (options.output_format == "RRD"):
+			rrd_errors = write_rrd([(options, result[0])])
+			if (len (rrd_errors)):
+				raise Exception(rrd_errors.values()[0])
+		if (options.output_format in LINE_FORMATS):
+			line_errors = write_lines([(None, options, result)])
+			if (len (line_errors)):
+				raise line_errors[None]
+		else:
+			output(options, *result)
 
 except Exception, e:
 	if (verbose >= 2):
+		import traceback
 		traceback.print_exc(e)
 	print "ERROR: %s" % str(e)
-
-	sessionclose()
-
@@ -0,0 +1,43 @@
+#!/usr/bin/python -S
+
+""" Client shim running a check of the UBNT Nagios plugins in ubnt-check-server.py """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+# Python starts without the site module (-S above) and only loads what
+# it needs to talk to the server, to take as little time as possible
+import sys
+import socket
+
+SOCKET = "/var/tmp/ubnt-nagios-plugins/check.sock"
+
+args = sys.argv[1:]
+path = SOCKET
+if (len (args) and args[0].startswith("--socket=")):
+	path = args.pop(0)[len ("--socket="):]
+if (not len (args) or args[0] in ("-h", "--help")):
+	print "Usage: %s [--socket=<path>] <model> [options of the plugin]" % sys.argv[0]
+	print "Run a check of the UBNT Nagios plugins in ubnt-check-server.py (at %s by default), printing its output and exiting with its status." % SOCKET
+	sys.exit(3)
+
+try:
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	sock.connect(path)
+	sock.sendall("\0".join (args))
+	sock.shutdown(socket.SHUT_WR)
+	response = []
+	while True:
+		data = sock.recv(65536)
+		if (not data):
+			break
+		response.append(data)
+	sock.close()
+	(header, newline, output) = "".join (response).partition("\n")
+	(status, length) = [int(n) for n in header.split()]
+except (socket.error, ValueError), e:
+	print "UNKNOWN: no response from ubnt-check-server.py at %s: %s" % (path, str(e) or "connection closed")
+	sys.exit(3)
+
+sys.stdout.write(output[:length])
+sys.stderr.write(output[length:])
+sys.exit(status)
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+
+""" Resident server running the checks of the UBNT Nagios plugins """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+import sys
+import socket
+import signal
+import threading
+import SocketServer
+from cStringIO import StringIO
+from optparse import OptionParser
+from NagiosPlugin import NagiosPlugin
+from UBNTClient import UBNTClient, STATE_DIR
+from ClientPool import ClientPool
+from ResponseCache import makedirs_shared
+import UBNTChecks
+
+# The modules imported by the checks when first needed, loaded once here
+import json, ssl, urllib2, cookielib
+import UBNTAsync, MultiPartForm, JSONStream
+
+# Name of the plugin of each model, for its usage and errors
+PLUGINS = {
+	'AF24': "UBNT-AF24_http.py",
+	'M': "UBNT-M_http.py",
+}
+
+# Options for the client of a check: checks with the same ones share a
+# client, and its session and connection
+CLIENT_OPTIONS = ('httphost', 'username', 'password', 'verbose', 'keepalive', 'timing', 'session_cache', 'state_dir', 'cache_ttl', 'circuit_failures', 'circuit_cooldown', 'max_sessions', 'request_spacing')
+
+# Largest request accepted
+MAX_REQUEST = 65536
+
+class ThreadOutput(object):
+	"""
+	Replaces sys.stdout or sys.stderr, so that the output of each check
+	is kept apart while capture()d by the thread running it
+	"""
+	def __init__ (self, file):
+		self.file = file
+		self.local = threading.local()
+
+	def write (self, data):
+		buffer = getattr(self.local, 'buffer', None)
+		if (buffer is None):
+			self.file.write(data)
+		else:
+			buffer.write(data)
+
+	def __getattr__ (self, name):
+		return getattr(self.file, name)
+
+	def capture (self):
+		self.local.buffer = StringIO()
+
+	def release (self):
+		"""Stop capturing and return the output captured"""
+		output = self.local.buffer.getvalue()
+		self.local.buffer = None
+		return output
+
+def plugin_parser (model):
+	"""Parser class for the plugin of model, named after its script"""
+	return lambda **kwargs: OptionParser(prog=PLUGINS.get(model), **kwargs)
+
+def check (pool, args):
+	"""
+	Run the check of a model with the arguments of its plugin, args =
+	[model, arguments...], printing the output of the plugin, and
+	return its exit status
+	"""
+	if (not len (args) or args[0] not in UBNTChecks.CHECKS):
+		print "UNKNOWN: the first argument must be a model (%s)" % ", ".join (sorted (UBNTChecks.CHECKS))
+		return NagiosPlugin.returnValues['UNKNOWN']
+	(setup, checkModel) = UBNTChecks.CHECKS[args[0]]
+	plugin = setup (plugin_parser (args[0]))
+	UBNTChecks.begin (plugin, args[1:])
+
+	options = plugin.options
+	def create():
+		client = UBNTClient.from_options(options)
+		client.keep_session = True
+		return client
+	key = tuple(getattr(options, name) for name in CLIENT_OPTIONS)
+	# Another check of the device in progress: run this one concurrently,
+	# with a client of its own, rather than waiting for it
+	with pool.client(key, create, wait=False) as client:
+		UBNTChecks.run (plugin, checkModel, client)
+	print plugin.getOutput()
+	return plugin.returnValue
+
+class CheckHandler(SocketServer.StreamRequestHandler):
+	"""
+	Reads the arguments of a check, separated by NUL characters, until
+	the client shuts down its side of the connection, and responds with
+	"<exit status> <length of output>\\n<output><errors>"
+	"""
+	def handle (self):
+		request = self.rfile.read(MAX_REQUEST + 1)
+		sys.stdout.capture()
+		sys.stderr.capture()
+		try:
+			if (len (request) > MAX_REQUEST):
+				raise Exception("request too long")
+			status = check(self.server.pool, request.split("\0"))
+		except SystemExit, e:
+			# Usage errors, --help and --version
+			status = e.code
+			if (status is None):
+				status = 0
+			elif (not isinstance(status, int)):
+				print >>sys.stderr, status
+				status = 1
+		except Exception, e:
+			print "UNKNOWN: %s" % str(e)
+			status = NagiosPlugin.returnValues['UNKNOWN']
+		finally:
+			output = sys.stdout.release()
+			errors = sys.stderr.release()
+		if (self.server.options.verbose):
+			print >>sys.stderr, "%s: %d" % (" ".join (request.split("\0")[:1]), status)
+		self.wfile.write("%d %d\n%s%s" % (status, len (output), output, errors))
+
+class CheckServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	"""Serves each check in a thread of its own, running concurrently"""
+	daemon_threads = True
+	request_queue_size = 128
+
+def listen (path):
+	"""Return a server listening at path, only accessible by this user"""
+	if (os.path.exists(path)):
+		# Left by a server that is no longer running?
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			sock.connect(path)
+		except socket.error:
+			os.unlink(path)
+		else:
+			raise Exception("already running at %s" % path)
+		finally:
+			sock.close()
+	elif (not os.path.isdir(os.path.dirname(path) or ".")):
+		makedirs_shared(os.path.dirname(path))
+	umask = os.umask(0077)
+	try:
+		return CheckServer(path, CheckHandler)
+	finally:
+		os.umask(umask)
+
+def build_parser():
+	parser = OptionParser(usage="Usage: %prog [options]", description="Resident server running the checks of the UBNT Nagios plugins for ubnt-check-client.py, which takes the same arguments as the plugins after the model (%s), e.g.: ubnt-check-client.py M -H https://10.0.0.1 -P secret -w -70. Checks are run concurrently, with the plugin modules loaded once, and the sessions and connections to each device are kept open between checks, until it has not been checked for --idle seconds." % ", ".join (sorted (UBNTChecks.CHECKS)))
+	parser.add_option("-V", "--version", action="store_true", help="show the version and exit")
+	parser.add_option("-v", "--verbose", action="count", help="log each check to standard error")
+	parser.add_option("-s", "--socket", default=os.path.join(STATE_DIR, "check.sock"), help="UNIX socket to listen on (default: %default)")
+	parser.add_option("--idle", type="int", default=300, help="seconds after the last check of a device to logout (default: 300)")
+	return parser
+
+
+parser = build_parser()
+verbose = None
+try:
+	(options, args) = parser.parse_args()
+	verbose = options.verbose
+
+	if (options.version):
+		print "%s %s" % (os.path.basename (sys.argv[0]), __version__)
+		sys.exit()
+
+	server = listen(options.socket)
+	server.options = options
+	server.pool = ClientPool(options.idle)
+	expirer = threading.Thread(target=server.pool.expire_forever)
+	expirer.daemon = True
+	expirer.start()
+
+	sys.stdout = ThreadOutput(sys.stdout)
+	sys.stderr = ThreadOutput(sys.stderr)
+
+	# Logout from all devices when terminated
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		os.unlink(options.socket)
+		server.pool.expire(0)
+
+except Exception, e:
+	if (verbose >= 2):
+		import traceback
+		traceback.print_exc(e)
+	print >>sys.stderr, "ERROR: %s" % str(e)
+	sys.exit(1)
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+
+""" Prometheus exporter for UBNT devices over HTTP """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+import re
+import sys
+import time
+import signal
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from optparse import OptionParser
+from UBNTClient import UBNTClient
+from ClientPool import ClientPool
+
+def poll (pool, target, sources, username, password, timeout, verbose=0):
+	"""Fetch sources from target, in the session kept by pool"""
+	create = lambda: UBNTClient(target, username, password, verbose=verbose, timeout=timeout)
+	with pool.client(target, create) as client:
+		client.reset_deadline()
+		return client.poll(sources)
+
+def normalize_target (target):
+	"""Return target as a URL, http:// being the default scheme"""
+	target = target.strip().rstrip("/")
+	if (target.find('://') == -1):
+		target = "http://" + target
+	return target
+
+def read_targets (options):
+	"""Return the set of the targets allowed by -T and --target-file"""
+	targets = set(normalize_target(t) for t in options.target or [])
+	if (options.target_file is not None):
+		f = open(options.target_file)
+		try:
+			for line in f:
+				line = line.split("#")[0].strip()
+				if (line):
+					targets.add(normalize_target(line))
+		finally:
+			f.close()
+	return targets
+
+def metric_samples(source, data):
+	"""
+	Return the numeric values (and booleans, as 0 or 1) in the data of
+	source as samples, (name, labels, value): named after the source and
+	the keys leading to each value, e.g. ubnt_status_wireless_signal,
+	with the index of each list on the way as a label (index, index2...)
+	"""
+	samples = []
+	def walk (value, name, labels):
+		if (isinstance(value, bool)):
+			samples.append((name, labels, int(value)))
+		elif (isinstance(value, (int, long, float))):
+			samples.append((name, labels, value))
+		elif (isinstance(value, dict)):
+			for key in sorted (value):
+				walk(value[key], "%s_%s" % (name, re.sub(r'[^a-zA-Z0-9_]', '_', key)), labels)
+		elif (isinstance(value, list)):
+			label = "index"
+			n = 1
+			while (label in [l for (l, v) in labels]):
+				n += 1
+				label = "index%d" % n
+			for i, item in enumerate(value):
+				walk(item, name, labels + ((label, str(i)),))
+	walk(data, "ubnt_%s" % source, ())
+	return samples
+
+def render(samples):
+	"""Format samples in the Prometheus text format, all as gauges"""
+	names = []
+	lines = {}
+	for (name, labels, value) in samples:
+		if (name not in lines):
+			names.append(name)
+			lines[name] = ["# TYPE %s gauge\n" % name]
+		series = name
+		if (len (labels)):
+			series += "{%s}" % ",".join ('%s="%s"' % (l, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for (l, v) in labels)
+		lines[name].append("%s %s\n" % (series, repr(value) if isinstance(value, float) else value))
+	return "".join ("".join (lines[name]) for name in names)
+
+class ExporterHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	"""Serves /metrics?target=<httphost>[&source=<source>...]"""
+	def log_message (self, format, *args):
+		if (self.server.options.verbose):
+			BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+	def respond (self, code, body, content_type="text/plain; charset=utf-8"):
+		self.send_response(code)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len (body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET (self):
+		url = urlparse.urlparse(self.path)
+		if (url.path != "/metrics"):
+			return self.respond(404, "Scrape /metrics?target=<httphost>[&source=<source>...]\n")
+		query = urlparse.parse_qs(url.query)
+		target = query.get('target', [None])[0]
+		if (target is None):
+			return self.respond(400, "target parameter is required\n")
+		# Only log in to the devices given, with the credentials given
+		target = normalize_target(target)
+		if (target not in self.server.targets):
+			return self.respond(400, "target not allowed: %s\n" % target)
+		sources = query.get('source', self.server.options.source)
+		for source in sources:
+			if (not re.match(r'^\w+$', source)):
+				return self.respond(400, "invalid source: %s\n" % source)
+
+		start = time.time()
+		samples = []
+		try:
+			options = self.server.options
+			data = poll(self.server.pool, target, sources, options.username, options.password, options.timeout, max(0, (options.verbose or 0) - 1))
+			for source in sources:
+				samples += metric_samples(source, data[source])
+			up = 1
+		except Exception, e:
+			if (self.server.options.verbose):
+				print >>sys.stderr, "%s: ERROR: %s" % (target, str(e))
+			up = 0
+		samples = [("ubnt_up", (), up), ("ubnt_scrape_duration_seconds", (), time.time() - start)] + samples
+		self.respond(200, render(samples), "text/plain; version=0.0.4; charset=utf-8")
+
+class ExporterServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	"""Serves each scrape in a thread of its own, polling concurrently"""
+	daemon_threads = True
+	allow_reuse_address = True
+	request_queue_size = 128
+
+def build_parser():
+	parser = OptionParser(usage="Usage: %prog [-U <username>] -P <password> (-T <httphost>... | --target-file <file>) [options]", description="Prometheus exporter for UBNT devices (over HTTP): serves the numeric values of the data sources of the device given as target, e.g. /metrics?target=https://10.0.0.1, as gauges. Sessions and connections to devices are kept open between scrapes, and scrapes are served concurrently.")
+	parser.add_option("-V", "--version", action="store_true", help="show the version and exit")
+	parser.add_option("-v", "--verbose", action="count", help="show debugging information")
+	parser.add_option("-a", "--address", default="127.0.0.1", help="address to listen on, \"\" for all (default: 127.0.0.1)")
+	parser.add_option("-p", "--port", type="int", default=9748, help="port to listen on (default: 9748)")
+	parser.add_option("-t", "--timeout", type="int", default=10, help="seconds before a scrape times out, for all the requests to the device together (default: 10)")
+	parser.add_option("-s", "--source", action="append", help="data source to fetch, unless given as source parameters of the scrape (may be repeated, default: status)")
+	parser.add_option("-T", "--target", action="append", help="device that may be scraped, as given in the target parameter, e.g. https://10.0.0.1 (may be repeated; http:// unless a scheme is given)")
+	parser.add_option("--target-file", help="file with the devices that may be scraped, one per line, as with -T")
+	parser.add_option("--idle", type="int", default=300, help="seconds after the last scrape of a device to logout (default: 300)")
+	parser.add_option("--max-devices", type="int", default=1000, help="number of devices to keep sessions with, logging out of the least recently scraped ones beyond that (default: 1000)")
+	parser.add_option("-U", "--username", default="ubnt", help="username (default: 'ubnt')")
+	parser.add_option("-P", "--password", help="password")
+	return parser
+
+
+parser = build_parser()
+verbose = None
+try:
+	(options, args) = parser.parse_args()
+	verbose = options.verbose
+
+	if (options.version):
+		print "%s %s" % (os.path.basename (sys.argv[0]), __version__)
+		sys.exit()
+
+	# Validate arguments
+	if (options.password is None):
+		parser.error("-P/--password option is required")
+	if (options.target is None and options.target_file is None):
+		parser.error("-T/--target or --target-file option is required")
+	if (options.max_devices < 1):
+		parser.error("--max-devices must be at least 1")
+	if (options.source is None):
+		options.source = ["status"]
+	targets = read_targets(options)
+
+	server = ExporterServer((options.address, options.port), ExporterHandler)
+	server.options = options
+	server.targets = targets
+	server.pool = ClientPool(options.idle, options.max_devices)
+	expirer = threading.Thread(target=server.pool.expire_forever)
+	expirer.daemon = True
+	expirer.start()
+
+	# Logout from all devices when terminated
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.pool.expire(0)
+
+except Exception, e:
+	if (verbose >= 2):
+		import traceback
+		traceback.print_exc(e)
+	print >>sys.stderr, "ERROR: %s" % str(e)
+	sys.exit(1)
@@ -0,0 +1,188 @@
+#!/usr/bin/python
+
+""" Script to check UBNT radio links in bulk and submit passive check results to Nagios """
+__version__ = "1.0"
+__author__ = "Zenon Mousmoulas"
+
+import os
+import sys
+import time
+import shlex
+from cStringIO import StringIO
+from optparse import OptionParser, OptionValueError
+from NagiosPlugin import NagiosPlugin
+import UBNTChecks
+
+class InventoryParser(OptionParser):
+	"""Parser for the plugin options in the inventory, raising errors"""
+	def error (self, msg):
+		raise OptionValueError(msg)
+
+class Check(object):
+	"""A service of the inventory, checked by one of UBNTChecks.CHECKS"""
+	def __init__ (self, host, service, model, args):
+		self.host = host
+		self.service = service
+		try:
+			(setup, self.check) = UBNTChecks.CHECKS[model]
+		except KeyError:
+			raise OptionValueError("unknown model: %s (available: %s)" % (model, ", ".join (sorted (UBNTChecks.CHECKS))))
+		self.plugin = setup(InventoryParser)
+		# -h/--help and -V/--version print and exit: only this check is
+		# left UNKNOWN, rather than the whole run ending (and printing
+		# into the commands)
+		self.exited = None
+		stdout = sys.stdout
+		sys.stdout = StringIO()
+		try:
+			UBNTChecks.begin(self.plugin, args)
+		except SystemExit:
+			self.exited = (sys.stdout.getvalue().strip() or "exited").split("\n")[0]
+		finally:
+			sys.stdout = stdout
+		self.start_time = None
+		self.finish_time = None
+
+	def run (self):
+		self.start_time = time.time()
+		if (self.exited is not None):
+			self.plugin.returnValue = self.plugin.returnValues['UNKNOWN']
+			self.plugin.returnString = "not checked, the plugin options end it early (%s)" % self.exited
+		else:
+			UBNTChecks.run(self.plugin, self.check)
+		self.finish_time = time.time()
+		return self
+
+	def output (self):
+		# Nagios takes a single line, newlines must be escaped
+		return self.plugin.getOutput().strip().replace("\\", "\\\\").replace("\n", "\\n")
+
+def build_parser():
+	parser = OptionParser(usage="Usage: %prog -i <inventory> (-C <command file> | -D <check result dir>) [options]", description="Check UBNT radio links in bulk, concurrently in a single process, and submit the results to Nagios as passive service check results.", epilog="Each line of the inventory holds a host name, a service description (quoted if it contains spaces), a model (%s) and the options of the respective plugin, e.g.: af24-link \"AF24 link\" AF24 -H https://10.0.0.1 -P secret -w -60,-60" % ", ".join (sorted (UBNTChecks.CHECKS)))
+	parser.add_option("-V", "--version", action="store_true", help="show the version and exit")
+	parser.add_option("-v", "--verbose", action="count", help="show debugging information")
+	parser.add_option("-i", "--inventory", help="file with the services to check, one per line (- for standard input)")
+	parser.add_option("-C", "--command-file", help="write PROCESS_SERVICE_CHECK_RESULT external commands to this file, typically the Nagios command pipe (- for standard output)")
+	parser.add_option("-D", "--check-result-dir", help="write the results as a check result file into this directory, where Nagios collects them (check_result_path)")
+	parser.add_option("-W", "--workers", type="int", default=10, help="number of services to check concurrently (default: 10)")
+	return parser
+
+def read_inventory(path):
+	"""Parse the services listed in the inventory into Checks"""
+	checks = []
+	f = sys.stdin if (path == '-') else open(path)
+	try:
+		for lineno, line in enumerate(f):
+			args = shlex.split(line, comments=True)
+			if (not len (args)):
+				continue
+			try:
+				if (len (args) < 3):
+					raise OptionValueError("expected a host name, a service description and a model")
+				checks.append(Check(args[0], args[1], args[2], args[3:]))
+			except OptionValueError, e:
+				raise Exception("%s, line %d: %s" % (path, lineno + 1, e))
+	finally:
+		if (f is not sys.stdin):
+			f.close()
+	return checks
+
+def write_commands(path, checks):
+	"""Write a PROCESS_SERVICE_CHECK_RESULT command for each check as it completes"""
+	if (path == '-'):
+		# sys.stdout is standard error meanwhile, see bulk()
+		fd = sys.__stdout__.fileno()
+	else:
+		fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+	try:
+		for check in checks:
+			# A single write per command, so that commands of other
+			# writers to the pipe are not interleaved with it
+			os.write(fd, "[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%d;%s\n" % (check.finish_time, check.host, check.service, check.plugin.returnValue, check.output()))
+	finally:
+		if (path != '-'):
+			os.close(fd)
+
+def write_check_results(path, checks):
+	"""Write all check results into a single check result file"""
+	import tempfile
+
+	(fd, filename) = tempfile.mkstemp(prefix='c', dir=path)
+	f = os.fdopen(fd, 'w')
+	try:
+		f.write("### Passive Check Result File ###\nfile_time=%d\n\n" % time.time())
+		for check in checks:
+			f.write("### Nagios Service Check Result ###\n")
+			f.write("# Time: %s\n" % time.ctime(check.finish_time))
+			f.write("host_name=%s\nservice_description=%s\n" % (check.host, check.service))
+			f.write("check_type=1\ncheck_options=0\nscheduled_check=0\nreschedule_check=0\nlatency=0.0\n")
+			f.write("start_time=%f\nfinish_time=%f\n" % (check.start_time, check.finish_time))
+			f.write("early_timeout=0\nexited_ok=1\nreturn_code=%d\n" % check.plugin.returnValue)
+			f.write("output=%s\n\n" % check.output())
+	finally:
+		f.close()
+	# Nagios only reads the file once the .ok file exists
+	os.chmod(filename, 0644)
+	open(filename + ".ok", 'w').close()
+
+def run_check(check):
+	return check.run()
+
+def bulk(options):
+	"""Check all services of the inventory concurrently and submit the results"""
+	from multiprocessing.pool import ThreadPool
+
+	checks = read_inventory(options.inventory)
+	if (not len (checks)):
+		return
+
+	# The commands go to standard output with -C -: anything else printed
+	# (e.g. by the plugins with -v in the inventory) goes to standard
+	# error, so that Nagios does not read it as commands
+	stdout = sys.stdout
+	if (options.command_file == '-'):
+		sys.stdout = sys.stderr
+	pool = ThreadPool(max(1, min(options.workers, len (checks))))
+	try:
+		results = pool.imap_unordered(run_check, checks)
+		if (options.command_file is not None):
+			write_commands(options.command_file, results)
+		else:
+			write_check_results(options.check_result_dir, list(results))
+	finally:
+		pool.close()
+		sys.stdout = stdout
+
+	if (options.verbose):
+		states = dict((v, k) for (k, v) in NagiosPlugin.returnValues.items())
+		counts = {}
+		for check in checks:
+			state = states[check.plugin.returnValue]
+			counts[state] = counts.get(state, 0) + 1
+		print >>sys.stderr, "%d services checked: %s" % (len (checks), ", ".join ("%d %s" % (counts[s], s) for s in sorted (counts)))
+
+
+parser = build_parser()
+verbose = None
+try:
+	(options, args) = parser.parse_args()
+	verbose = options.verbose
+
+	if (options.version):
+		print "%s %s" % (os.path.basename (sys.argv[0]), __version__)
+		sys.exit()
+
+	# Validate arguments
+	if (options.inventory is None):
+		parser.error("-i/--inventory option is required")
+	if ((options.command_file is None) == (options.check_result_dir is None)):
+		parser.error("either -C/--command-file or -D/--check-result-dir is required")
+
+	bulk(options)
+
+except Exception, e:
+	if (verbose >= 2):
+		import traceback
+		traceback.print_exc(e)
+	print >>sys.stderr, "ERROR: %s" % str(e)
+	sys.exit(1)